@@ -0,0 +1,279 @@
+"""
+Compares the bfloat16 autocast mode (--bf16) with float32 on CPU:
+the value outputs and greedy actions on a fixed set of decisions,
+actor decisions per second and learner steps per second. With
+--mode inference it reports the build time, per-decision latency and
+greedy action agreement with eager mode of every --actor_inference
+path instead. --mode history compares the transformer latency with
+the move history encoded once per decision and once per legal action.
+--mode profile reports the parameters, FLOPs, CPU latency and memory
+of one decision at several legal action counts for every network, the
+play presets and the --arch architectures. --corpus keeps the recorded
+decisions in a file, so several runs compare on the same states.
+
+    python benchmark.py --num_games 20 --learner_rows 1024
+    python benchmark.py --mode inference --inference eager trace int8 --corpus decisions.pt
+    python benchmark.py --mode profile --arch '{"type": "resnet", "blocks": 2, "se": false}'
+"""
+import argparse
+import json
+import os
+import random
+import timeit
+
+import numpy as np
+import torch
+from torch.utils.flop_counter import FlopCounterMode
+
+from douzero.dmc import parser as train_parser
+from douzero.dmc.dmc import compute_position_loss
+from douzero.dmc.env_utils import Environment
+from douzero.dmc.inference import INFERENCE_MODES, CompiledValues
+from douzero.dmc.checkpoint import load_position_model
+from douzero.dmc.models import STUDENT_PRESETS, GeneralModelBid, GeneralModelResnet, GeneralModelSplit, \
+    GeneralModelTransformer, create_model
+from douzero.dmc.utils import autocast, create_env
+
+BID_POSITIONS = ['first', 'second', 'third']
+
+
+def collect_decisions(num_games, wild_mode):
+    """
+    Play `num_games` games with random actions and keep the model
+    inputs of every decision with more than one legal action.
+    """
+    flags = train_parser.parse_args([])
+    flags.wild_mode = wild_mode
+    env = Environment(create_env(flags), 'cpu')
+    decisions = {'bid': [], 'play': []}
+    position, obs, env_output = env.initial(None, 'cpu', flags=flags)
+    games = 0
+    while games < num_games:
+        if len(obs['legal_actions']) > 1:
+            group = 'bid' if position in BID_POSITIONS else 'play'
+            decisions[group].append((obs['z_batch'].float(), obs['x_batch'].float()))
+        action = random.choice(obs['legal_actions'])
+        position, obs, env_output = env.step(action, None, 'cpu', flags=flags)
+        if env_output['done'].item() or env_output['draw'].item():
+            games += 1
+    return decisions
+
+
+def check_accuracy(model, decisions, margin=1e-3):
+    fp32_flags = argparse.Namespace(bf16=False)
+    bf16_flags = argparse.Namespace(bf16=True)
+    errors = [[], [], []]
+    agree, decisive, decisive_agree = 0, 0, 0
+    with torch.no_grad():
+        for z, x in decisions:
+            with autocast(fp32_flags, 'cpu'):
+                ref = model.values(z, x)
+            with autocast(bf16_flags, 'cpu'):
+                out = model.values(z, x)
+            for k in range(3):
+                errors[k].append((out[k] - ref[k]).abs().max().item())
+            ref_output = model.select_action(*ref, z)
+            same = ref_output['action'].item() == model.select_action(*out, z)['action'].item()
+            agree += same
+            # Decisions whose two best actions are this close flip on
+            # any rounding, e.g. with untrained weights
+            top2 = torch.topk(ref_output['values'].flatten(), 2).values
+            if top2[0] - top2[1] > margin:
+                decisive += 1
+                decisive_agree += same
+    return dict(
+        max_abs_error=' '.join('%s:%.4f' % (k, max(e)) for k, e in zip(['win_rate', 'win', 'lose'], errors)),
+        mean_abs_error=' '.join('%s:%.4f' % (k, np.mean(e)) for k, e in zip(['win_rate', 'win', 'lose'], errors)),
+        action_agreement='%.1f%% of all decisions, %.1f%% of %d decisions with a margin above %g' % (
+            100. * agree / len(decisions), 100. * decisive_agree / max(decisive, 1), decisive, margin),
+    )
+
+
+def actor_speed(model, decisions, bf16):
+    flags = argparse.Namespace(bf16=bf16)
+    with torch.no_grad(), autocast(flags, 'cpu'):
+        for z, x in decisions[:10]:
+            model.forward(z, x)
+        start = timeit.default_timer()
+        for z, x in decisions:
+            model.forward(z, x)
+    return len(decisions) / (timeit.default_timer() - start)
+
+
+def learner_speed(model, position, decisions, rows, steps, bf16):
+    flags = argparse.Namespace(bf16=bf16)
+    z = torch.cat([z for z, _ in decisions])
+    x = torch.cat([x for _, x in decisions])
+    index = torch.arange(rows) % z.shape[0]
+    z, x = z[index], x[index]
+    target_adp = torch.randn(rows)
+    target_wp = torch.randint(0, 2, (rows,)).float() * 2 - 1
+    target_wp_bid = torch.softmax(torch.randn(rows, 3), dim=-1)
+    optimizer = torch.optim.RAdam(model.parameters(), lr=1e-4)
+    model.train()
+    for step in range(steps + 1):
+        if step == 1:
+            # The first step only warms up
+            start = timeit.default_timer()
+        with autocast(flags, 'cpu'):
+            values = model.forward(z, x, return_value=True)['values']
+        loss = compute_position_loss(position, values, target_adp, target_wp, target_wp_bid)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    model.eval()
+    return steps / (timeit.default_timer() - start)
+
+
+def inference_latency(model, decisions, mode, margin=1e-3):
+    """
+    Build time (the first call) and mean latency of the other calls of
+    `mode` on `decisions`, and how often its greedy action is the one
+    of eager mode (overall and on decisions decided by more than
+    `margin`). The mode may have fallen back to eager.
+    """
+    values = CompiledValues(model, mode)
+    agree, decisive, decisive_agree = 0, 0, 0
+    with torch.no_grad():
+        start = timeit.default_timer()
+        values.forward(*decisions[0])
+        build = timeit.default_timer() - start
+        values.calls, values.time = 0, 0.
+        for z, x in decisions[1:]:
+            values.forward(z, x)
+        latency = values.latency()
+        for z, x in decisions:
+            ref_output = model.forward(z, x)
+            same = ref_output['action'].item() == values.forward(z, x)['action'].item()
+            agree += same
+            top2 = torch.topk(ref_output['values'].flatten(), 2).values
+            if top2[0] - top2[1] > margin:
+                decisive += 1
+                decisive_agree += same
+    agreement = '%.1f%% (%.1f%% of %d with a margin above %g)' % (
+        100. * agree / len(decisions), 100. * decisive_agree / max(decisive, 1), decisive, margin)
+    return values.mode, build, latency, agreement
+
+
+def history_latency(model, decisions):
+    """
+    Mean decision latency of `model` (a GeneralModelTransformer) with
+    the history encoded once per decision and once per legal action.
+    """
+    latency = {}
+    with torch.no_grad():
+        for share in [False, True]:
+            model.share_history = share
+            start = timeit.default_timer()
+            for z, x in decisions:
+                model.forward(z, x)
+            latency[share] = (timeit.default_timer() - start) / len(decisions)
+    model.share_history = True
+    return latency[False], latency[True]
+
+
+def profile(model, z, x, legal_actions, repeats=20):
+    """
+    Parameters, parameter memory and, for every count of
+    `legal_actions`, the FLOPs, mean CPU latency and memory allocated
+    by one decision of `model` on inputs shaped like `z` and `x`.
+    """
+    params = sum(p.numel() for p in model.parameters())
+    param_mb = sum(t.numel() * t.element_size() for t in model.state_dict().values()) / 2 ** 20
+    rows = []
+    with torch.no_grad():
+        for n in legal_actions:
+            z_n, x_n = z[:1].expand(n, *z.shape[1:]).contiguous(), x[:1].expand(n, *x.shape[1:]).contiguous()
+            with FlopCounterMode(display=False) as counter:
+                model.forward(z_n, x_n)
+            with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                        profile_memory=True) as prof:
+                model.forward(z_n, x_n)
+            allocated = sum(max(e.self_cpu_memory_usage, 0) for e in prof.key_averages()) / 2 ** 20
+            start = timeit.default_timer()
+            for _ in range(repeats):
+                model.forward(z_n, x_n)
+            rows.append((n, counter.get_total_flops(), (timeit.default_timer() - start) / repeats, allocated))
+    return params, param_mb, rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('AlphaDou bfloat16 benchmark')
+    parser.add_argument('--mode', type=str, default='bf16', choices=['bf16', 'inference', 'history', 'profile'])
+    parser.add_argument('--inference', type=str, nargs='+', default=INFERENCE_MODES,
+                        choices=INFERENCE_MODES, help='Inference paths compared with --mode inference')
+    parser.add_argument('--num_games', type=int, default=20)
+    parser.add_argument('--corpus', type=str, default='',
+                        help='File of recorded decisions, written on the first run and reused afterwards')
+    parser.add_argument('--learner_rows', type=int, default=1024,
+                        help='Rows in a learner batch (T * B)')
+    parser.add_argument('--learner_steps', type=int, default=5)
+    parser.add_argument('--bid_model', type=str, default='',
+                        help='Optional bid position checkpoint (e.g. first_0.ckpt)')
+    parser.add_argument('--play_model', type=str, default='',
+                        help='Optional play position checkpoint (e.g. landlord_0.ckpt)')
+    parser.add_argument('--arch', type=str, nargs='*', default=[],
+                        help='Play position architectures (JSON, see create_model) also profiled by --mode profile')
+    parser.add_argument('--legal_actions', type=int, nargs='+', default=[1, 5, 10, 20, 50],
+                        help='Legal action counts of --mode profile')
+    parser.add_argument('--wild_mode', action='store_true')
+    parser.add_argument('--num_threads', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+
+    if args.corpus and os.path.exists(args.corpus):
+        decisions = torch.load(args.corpus)
+    else:
+        decisions = collect_decisions(args.num_games, args.wild_mode)
+        if args.corpus:
+            torch.save(decisions, args.corpus)
+    models = {
+        'bid': ('first', load_position_model(args.bid_model) if args.bid_model else GeneralModelBid(),
+                decisions['bid']),
+        'play': ('landlord', load_position_model(args.play_model) if args.play_model else GeneralModelResnet(),
+                 decisions['play']),
+        'split': ('landlord', GeneralModelSplit(), decisions['play']),
+        'transformer': ('landlord', GeneralModelTransformer(), decisions['play']),
+    }
+    if args.mode == 'profile':
+        for name, preset in STUDENT_PRESETS.items():
+            models['resnet ' + name] = ('landlord', create_model(dict(type='resnet', **preset)), decisions['play'])
+        for arch in args.arch:
+            models[arch] = ('landlord', create_model(json.loads(arch)), decisions['play'])
+    for name, (position, model, model_decisions) in models.items():
+        model.eval()
+        if args.mode == 'profile':
+            params, param_mb, rows = profile(model, *model_decisions[0], args.legal_actions)
+            print('%s: %.2fM parameters (%.1f MB)' % (name, params / 1e6, param_mb))
+            for n, flops, latency, allocated in rows:
+                print('  %3d legal actions: %8.1f MFLOPs %8.3f ms/decision %7.1f MB allocated' % (
+                    n, flops / 1e6, latency * 1000, allocated))
+            continue
+        if args.mode == 'history':
+            if name == 'transformer':
+                per_action, shared = history_latency(model, model_decisions)
+                print('transformer (%d decisions, %.1f legal actions on average)' % (
+                    len(model_decisions), np.mean([z.shape[0] for z, _ in model_decisions])))
+                print('  history per legal action: %.3f ms/decision' % (per_action * 1000))
+                print('  history per decision: %.3f ms/decision (x%.2f)' % (shared * 1000, per_action / shared))
+            continue
+        print('%s (%d decisions)' % (name, len(model_decisions)))
+        if args.mode == 'inference':
+            for mode in args.inference:
+                used, build, latency, agreement = inference_latency(model, model_decisions, mode)
+                print('  %s: build %.2fs, %.3f ms/decision, action agreement %s%s' % (
+                    mode, build, latency * 1000, agreement, '' if used == mode else ' (fell back to %s)' % used))
+            continue
+        for k, v in check_accuracy(model, model_decisions).items():
+            print('  %s: %s' % (k, v))
+        fp32, bf16 = actor_speed(model, model_decisions, False), actor_speed(model, model_decisions, True)
+        print('  actor decisions/s: fp32 %.1f bf16 %.1f (x%.2f)' % (fp32, bf16, bf16 / fp32))
+        fp32 = learner_speed(model, position, model_decisions, args.learner_rows, args.learner_steps, False)
+        bf16 = learner_speed(model, position, model_decisions, args.learner_rows, args.learner_steps, True)
+        print('  learner steps/s: fp32 %.2f bf16 %.2f (x%.2f)' % (fp32, bf16, bf16 / fp32))
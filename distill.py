@@ -0,0 +1,212 @@
+"""
+Distills the play position networks (GeneralModelResnet) into cheaper
+students for CPU actors and evaluation. The students are fitted to the
+(win_rate, win, lose) outputs of the teachers on the decisions of games
+the teachers play against themselves. A student is a smaller
+GeneralModelResnet from STUDENT_PRESETS, or the split state encoder
+(--play_model split) initialised from the teacher.
+
+    python distill.py --presets
+    python distill.py --landlord landlord_0.ckpt --landlord_up landlord_up_0.ckpt \\
+        --landlord_down landlord_down_0.ckpt --student small --output_dir students/small \\
+        --eval_data eval_data.pkl
+
+Every student is written to <output_dir>/<position>.ckpt with its
+architecture and loads with DeepAgent like the training checkpoints.
+DeepAgent picks the network by the path, so the path must not contain
+"test" or "best".
+"""
+import argparse
+import os
+import random
+import timeit
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from douzero.dmc import parser as train_parser
+from douzero.dmc.env_utils import Environment
+from douzero.dmc.checkpoint import load_position_model, save_position
+from douzero.dmc.models import STUDENT_PRESETS, GeneralModelResnet, create_model, infer_arch, split_from_resnet
+from douzero.dmc.utils import create_env
+from douzero.evaluation.simulation import evaluate
+
+PLAY_POSITIONS = ['landlord', 'landlord_up', 'landlord_down']
+
+
+def load_teacher(path):
+    return load_position_model(path)
+
+
+def make_student(teacher, student):
+    if student == 'split':
+        return split_from_resnet(teacher)
+    return create_model(dict(type='resnet', **STUDENT_PRESETS[student]))
+
+
+def record_self_play(teachers, num_games, epsilon=0.1, wild_mode=False):
+    """
+    Play `num_games` games in which the teachers choose the moves of
+    their positions (with `epsilon` exploration) and the bids are
+    random. Returns the model inputs of every decision with more than
+    one legal action, per position.
+    """
+    flags = train_parser.parse_args([])
+    flags.wild_mode = wild_mode
+    flags.exp_epsilon = epsilon
+    env = Environment(create_env(flags), 'cpu')
+    decisions = {p: [] for p in teachers}
+    position, obs, env_output = env.initial(None, 'cpu', flags=flags)
+    games = 0
+    while games < num_games:
+        if position in teachers and len(obs['legal_actions']) > 1:
+            z, x = obs['z_batch'].float(), obs['x_batch'].float()
+            decisions[position].append((z, x))
+            with torch.no_grad():
+                action = obs['legal_actions'][teachers[position].forward(z, x, flags=flags)['action'].item()]
+        else:
+            action = random.choice(obs['legal_actions'])
+        position, obs, env_output = env.step(action, None, 'cpu', flags=flags)
+        if env_output['done'].item() or env_output['draw'].item():
+            games += 1
+    return decisions
+
+
+def distill_loss(student, teacher, z, x):
+    with torch.no_grad():
+        target = teacher.values(z, x)
+    return sum(F.mse_loss(out, t) for out, t in zip(student.values(z, x), target))
+
+
+def distill(student, teacher, decisions, epochs=5, lr=1e-4, decisions_per_batch=32):
+    """
+    Fit the value outputs of `student` to those of `teacher`. Every
+    batch holds whole decisions, so a split student encodes their
+    states once like in the actors. Returns the mean loss of the last
+    epoch.
+    """
+    optimizer = torch.optim.Adam(student.parameters(), lr=lr)
+    teacher.eval()
+    student.train()
+    for epoch in range(epochs):
+        random.shuffle(decisions)
+        losses = []
+        for n in range(0, len(decisions), decisions_per_batch):
+            batch = decisions[n:n + decisions_per_batch]
+            loss = distill_loss(student, teacher,
+                                torch.cat([z for z, _ in batch]), torch.cat([x for _, x in batch]))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.item())
+        print('  epoch %d: loss %.6f' % (epoch, np.mean(losses)))
+    student.eval()
+    return np.mean(losses)
+
+
+def agreement(student, teacher, decisions):
+    """
+    Held-out loss and how often the greedy action of `student` is the
+    one of `teacher`.
+    """
+    same, losses = 0, []
+    with torch.no_grad():
+        for z, x in decisions:
+            losses.append(distill_loss(student, teacher, z, x).item())
+            same += student.forward(z, x)['action'].item() == teacher.forward(z, x)['action'].item()
+    return np.mean(losses), same / len(decisions)
+
+
+def preset_table(legal_actions=10, repeats=20):
+    """Parameters and eager latency of one decision of every preset."""
+    z, x = torch.rand(legal_actions, 72, 54), torch.rand(legal_actions, 18)
+    rows = []
+    for name, preset in STUDENT_PRESETS.items():
+        model = GeneralModelResnet(**preset).eval()
+        with torch.no_grad():
+            model.values(z, x)
+            start = timeit.default_timer()
+            for _ in range(repeats):
+                model.values(z, x)
+        rows.append((name, sum(p.numel() for p in model.parameters()),
+                     (timeit.default_timer() - start) / repeats))
+    return rows
+
+
+def compare_in_games(teacher_paths, student_paths, bid, eval_data, num_workers):
+    """
+    Landlord results of the students against the teachers through
+    `evaluate`: teachers on all seats, a student landlord against the
+    teacher farmers and the teacher landlord against student farmers.
+    """
+    def run(landlord, landlord_down, landlord_up):
+        return evaluate(bid, bid, bid, landlord, landlord_down, landlord_up, eval_data, num_workers)
+
+    teacher = [teacher_paths[p] for p in ['landlord', 'landlord_down', 'landlord_up']]
+    student = [student_paths[p] for p in ['landlord', 'landlord_down', 'landlord_up']]
+    return {
+        'teacher vs teacher': run(*teacher),
+        'student landlord vs teacher farmers': run(student[0], teacher[1], teacher[2]),
+        'teacher landlord vs student farmers': run(teacher[0], student[1], student[2]),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('AlphaDou student distillation')
+    parser.add_argument('--presets', action='store_true',
+                        help='Only print the size and latency of the student presets')
+    for position in PLAY_POSITIONS:
+        parser.add_argument('--' + position, type=str, default='',
+                            help='Teacher checkpoint of the %s position' % position)
+    parser.add_argument('--student', type=str, default='small', choices=list(STUDENT_PRESETS) + ['split'])
+    parser.add_argument('--output_dir', type=str, default='students')
+    parser.add_argument('--num_games', type=int, default=200,
+                        help='Self-play games recorded for training')
+    parser.add_argument('--eval_games', type=int, default=20,
+                        help='Self-play games recorded for the held-out agreement')
+    parser.add_argument('--exp_epsilon', type=float, default=0.1,
+                        help='Random move probability of the teachers while recording')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--lr', type=float, default=1e-4)
+    parser.add_argument('--eval_data', type=str, default='',
+                        help='Also compare students and teachers in games (e.g. eval_data.pkl)')
+    parser.add_argument('--bid', type=str, default='random',
+                        help='Bidding agent of all seats in the games')
+    parser.add_argument('--num_workers', type=int, default=2)
+    parser.add_argument('--wild_mode', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.presets:
+        torch.set_num_threads(1)
+        for name, params, latency in preset_table():
+            print('%-8s %6.2fM parameters %7.2f ms/decision' % (name, params / 1e6, latency * 1000))
+        raise SystemExit
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    teacher_paths = {p: getattr(args, p) for p in PLAY_POSITIONS if getattr(args, p)}
+    assert not args.eval_data or len(teacher_paths) == len(PLAY_POSITIONS), \
+        'Comparing in games (--eval_data) needs the teachers of all play positions'
+    teachers = {p: load_teacher(path) for p, path in teacher_paths.items()}
+    train_decisions = record_self_play(teachers, args.num_games, args.exp_epsilon, args.wild_mode)
+    eval_decisions = record_self_play(teachers, args.eval_games, args.exp_epsilon, args.wild_mode)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    student_paths = {}
+    for position, teacher in teachers.items():
+        student = make_student(teacher, args.student)
+        print('%s: %d training decisions' % (position, len(train_decisions[position])))
+        distill(student, teacher, train_decisions[position], args.epochs, args.lr)
+        loss, agree = agreement(student, teacher, eval_decisions[position])
+        print('%s: held-out loss %.6f, action agreement %.1f%%' % (position, loss, 100. * agree))
+        student_paths[position] = os.path.join(args.output_dir, position + '.ckpt')
+        save_position(student_paths[position], student.state_dict(), infer_arch(student.state_dict()))
+
+    if args.eval_data:
+        for name, result in compare_in_games(teacher_paths, student_paths, args.bid,
+                                             args.eval_data, args.num_workers).items():
+            print('%s: landlord WP %.3f ADP %.3f' % (name, result['landlord_wp'], result['landlord_adp']))
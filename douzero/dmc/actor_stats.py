@@ -0,0 +1,108 @@
+"""
+Cheap throughput counters for the actor processes. Every actor
+owns one row of a shared-memory tensor and only adds to it once
+per game, so the main process can read the totals at any time
+without any locking or message passing.
+"""
+import os
+import resource
+
+import torch
+
+# Seconds spent in each phase of the actor loop, followed by counts
+ACTOR_PHASES = ['env_step', 'encode', 'forward', 'assemble', 'queue_put']
+ACTOR_STAT_KEYS = ACTOR_PHASES + ['games', 'decisions']
+
+# Upper bounds of the legal-action-count histogram buckets. The last
+# bucket collects everything above the largest bound.
+LEGAL_ACTION_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+
+def _current_rss():
+    """
+    Resident set size of this process in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the peak and is reported in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ActorStats:
+    """
+    Shared counters for `num_actors` actors. Create it in the main
+    process before starting the actors and hand each actor the
+    recorder of its own row.
+    """
+    def __init__(self, num_actors):
+        self.counters = torch.zeros(num_actors, len(ACTOR_STAT_KEYS), dtype=torch.float64).share_memory_()
+        self.legal_actions = torch.zeros(num_actors, len(LEGAL_ACTION_BUCKETS) + 1,
+                                         dtype=torch.int64).share_memory_()
+        self.rss = torch.zeros(num_actors, dtype=torch.int64).share_memory_()
+        # Actor threads of the same process report the same RSS, the pid
+        # lets the report count every process once
+        self.pid = torch.zeros(num_actors, dtype=torch.int64).share_memory_()
+
+    def recorder(self, index):
+        return ActorStatsRecorder(self, index)
+
+    def snapshot(self):
+        counters = self.counters.sum(dim=0).tolist()
+        return dict(
+            counters=dict(zip(ACTOR_STAT_KEYS, counters)),
+            legal_actions=self.legal_actions.sum(dim=0).tolist(),
+            rss=self.rss.tolist(),
+            pid=self.pid.tolist(),
+        )
+
+
+class ActorStatsRecorder:
+    """
+    Accumulates the measurements of one actor in plain Python numbers
+    and adds them to the shared row when `flush` is called.
+    """
+    def __init__(self, stats, index):
+        self.stats = stats
+        self.index = index
+        self._values = [0.] * len(ACTOR_STAT_KEYS)
+        self._legal_actions = [0] * (len(LEGAL_ACTION_BUCKETS) + 1)
+        self._key_index = {k: n for n, k in enumerate(ACTOR_STAT_KEYS)}
+
+    def add(self, key, value):
+        self._values[self._key_index[key]] += value
+
+    def add_legal_actions(self, num_legal_actions):
+        bucket = len(LEGAL_ACTION_BUCKETS)
+        for n, bound in enumerate(LEGAL_ACTION_BUCKETS):
+            if num_legal_actions <= bound:
+                bucket = n
+                break
+        self._legal_actions[bucket] += 1
+
+    def flush(self):
+        self.stats.counters[self.index] += torch.tensor(self._values, dtype=torch.float64)
+        self.stats.legal_actions[self.index] += torch.tensor(self._legal_actions, dtype=torch.int64)
+        self.stats.rss[self.index] = _current_rss()
+        self.stats.pid[self.index] = os.getpid()
+        self._values = [0.] * len(ACTOR_STAT_KEYS)
+        self._legal_actions = [0] * (len(LEGAL_ACTION_BUCKETS) + 1)
+
+
+def format_actor_stats(current, last, elapsed):
+    """
+    Build the log line from two snapshots taken `elapsed` seconds apart.
+    """
+    delta = {k: current['counters'][k] - last['counters'][k] for k in ACTOR_STAT_KEYS}
+    busy = sum(delta[k] for k in ACTOR_PHASES)
+    phases = ' '.join('%s:%.0f%%' % (k, 100. * delta[k] / busy if busy > 0 else 0.) for k in ACTOR_PHASES)
+    legal = [c - l for c, l in zip(current['legal_actions'], last['legal_actions'])]
+    total_legal = max(sum(legal), 1)
+    labels = ['<=%d' % b for b in LEGAL_ACTION_BUCKETS] + ['>%d' % LEGAL_ACTION_BUCKETS[-1]]
+    histogram = ' '.join('%s:%.1f%%' % (label, 100. * n / total_legal) for label, n in zip(labels, legal) if n > 0)
+    rss = {pid: r for pid, r in zip(current['pid'], current['rss']) if r > 0}
+    num_reporting = sum(1 for r in current['rss'] if r > 0)
+    mean_rss = sum(rss.values()) / num_reporting / 2 ** 20 if num_reporting else 0.
+    return 'games %.2f/s decisions %.1f/s | %s | legal actions %s | rss %.0fMB/actor' % (
+        delta['games'] / elapsed, delta['decisions'] / elapsed, phases, histogram, mean_rss)
@@ -0,0 +1,141 @@
+"""
+Thread-based actors. One process runs several actor threads that share
+a single copy of the model. Decisions are submitted to an in-process
+micro-batcher which concatenates the requests of the same position and
+scores them with one forward pass. Torch releases the GIL inside its
+operators, so the engine and encoding work of the other threads can
+run while a batch is being scored.
+"""
+import queue
+import threading
+import time
+import timeit
+import traceback
+
+import torch
+
+from .inference import InferenceModel
+from .utils import act, log, actor_crash_path, autocast
+
+
+class _Request:
+    __slots__ = ('position', 'z', 'x', 'flags', 'event', 'result', 'error')
+
+    def __init__(self, position, z, x, flags):
+        self.position = position
+        self.z = z
+        self.x = x
+        self.flags = flags
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InferenceBatcher:
+    """
+    Drop-in replacement for `Model.forward` shared by the actor threads
+    of one process. A request waits at most `max_wait` seconds for the
+    other threads before its batch is run. Autocast is thread-local, so
+    --bf16 is applied here and not in the actor threads.
+    """
+    def __init__(self, model, max_batch, max_wait=0.001, flags=None, device='cpu'):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.flags = flags
+        self.device = device
+        self.requests = queue.Queue()
+        self.num_batches = 0
+        self.num_requests = 0
+        self._thread = threading.Thread(target=self._loop, name='inference-batcher', daemon=True)
+        self._thread.start()
+
+    def forward(self, position, z, x, training=False, flags=None, debug=False):
+        request = _Request(position, z, x, flags)
+        self.requests.put(request)
+        request.event.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def get_version(self, position):
+        return self.model.get_version(position)
+
+    def _collect(self):
+        requests = [self.requests.get()]
+        deadline = timeit.default_timer() + self.max_wait
+        while len(requests) < self.max_batch:
+            timeout = deadline - timeit.default_timer()
+            if timeout <= 0:
+                break
+            try:
+                requests.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return requests
+
+    def _loop(self):
+        while True:
+            requests = self._collect()
+            by_position = {}
+            for request in requests:
+                by_position.setdefault(request.position, []).append(request)
+            for position, group in by_position.items():
+                try:
+                    self._run(position, group)
+                except Exception as e:
+                    for request in group:
+                        request.error = e
+                for request in group:
+                    request.event.set()
+            self.num_batches += 1
+            self.num_requests += len(requests)
+
+    def _run(self, position, group):
+        model = self.model.get_model(position)
+        sizes = [request.z.shape[0] for request in group]
+        with torch.no_grad(), autocast(self.flags, self.device):
+            if len(group) == 1:
+                values = model.values(group[0].z, group[0].x)
+            else:
+                values = model.values(torch.cat([r.z for r in group]), torch.cat([r.x for r in group]))
+        with torch.no_grad():
+            splits = [torch.split(v, sizes) for v in values]
+            for n, request in enumerate(group):
+                request.result = model.select_action(*(v[n] for v in splits), request.z, request.flags)
+
+
+def act_threads(i, device, batch_queues, model, flags, recorders, seed=None):
+    """
+    Process target of the thread mode. Runs one `act` loop per recorder
+    in daemon threads and exits as soon as one of them dies, so that the
+    supervisor restarts the whole process. The random generators are
+    process-wide, so only the first thread seeds them.
+    """
+    if flags.actor_inference != 'eager':
+        model = InferenceModel(model, flags.actor_inference, flags.inference_refresh)
+    batcher = InferenceBatcher(model, max_batch=len(recorders), max_wait=flags.actor_batch_wait_ms / 1000.,
+                               flags=flags, device=device)
+    threads = []
+    for k, recorder in enumerate(recorders):
+        thread = threading.Thread(
+            target=act, name='actor-%d-%d' % (i, k), daemon=True,
+            args=(i, device, batch_queues, batcher, flags, recorder,
+                  seed if k == 0 else None))
+        thread.start()
+        threads.append(thread)
+    log.info('Device %s Actor process %i started %d actor threads.', str(device), i, len(threads))
+    try:
+        while all(thread.is_alive() for thread in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        return
+    dead = [thread.name for thread in threads if not thread.is_alive()]
+    message = 'Actor thread(s) %s of process %i died' % (', '.join(dead), i)
+    log.error(message)
+    try:
+        with open(actor_crash_path(flags, device, i), 'a') as f:
+            f.write('\n' + message + '\n')
+    except OSError:
+        traceback.print_exc()
+    raise RuntimeError(message)
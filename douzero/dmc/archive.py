@@ -0,0 +1,135 @@
+"""
+Checkpoint archives pack many position checkpoints into one file, so
+evaluation sweeps load any of them through one memory map instead of
+listing and opening thousands of files. The checkpoint files are stored
+back to back as written by torch.save, followed by a JSON index of
+name -> (offset, size), the offset of that index and MAGIC:
+
+    [checkpoint][checkpoint]...[index][index offset][MAGIC]
+
+Appending writes the new checkpoints and a new index after the end of
+the file, so a reader (or a crash) never sees a half-written index. The
+old index stays behind as a few unused bytes.
+
+A checkpoint in an archive is named like the file it came from without
+".ckpt" (e.g. landlord_1000) and is loaded with the path
+"<archive>#<name>", e.g. "checkpoints.ckpa#landlord_1000". Checkpoints
+start at aligned offsets, so the tensors of memory-mapped checkpoints
+(see mapped.py) are views of the archive mapping.
+"""
+import io
+import json
+import mmap
+import os
+import struct
+
+import torch
+
+from .mapped import ALIGNMENT, is_mapped, load_mapped, read_mapped
+
+MAGIC = b'ALPHADOU-CKPA-1\n'
+TRAILER = struct.Struct('<Q')
+ARCHIVE_SEPARATOR = '#'
+
+
+class CheckpointArchive:
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        self._mmap = None
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the index, e.g. after another process appended to the archive."""
+        self.close()
+        self.index = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            tail = TRAILER.size + len(MAGIC)
+            if end < tail:
+                raise ValueError('%s is not a checkpoint archive' % self.path)
+            f.seek(end - tail)
+            trailer = f.read(tail)
+            if trailer[TRAILER.size:] != MAGIC:
+                raise ValueError('%s is not a checkpoint archive' % self.path)
+            index_offset, = TRAILER.unpack(trailer[:TRAILER.size])
+            f.seek(index_offset)
+            self.index = {k: tuple(v) for k, v in json.loads(f.read(end - tail - index_offset)).items()}
+
+    def names(self):
+        return list(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, entries):
+        """
+        Add the checkpoint files of `entries`, a dict of name -> path, in
+        one write. Existing names are replaced.
+        """
+        self.close()
+        with open(self.path, 'ab') as f:
+            f.seek(0, os.SEEK_END)
+            for name, path in entries.items():
+                f.write(b'\0' * (-f.tell() % ALIGNMENT))
+                offset = f.tell()
+                with open(path, 'rb') as src:
+                    data = src.read()
+                f.write(data)
+                self.index[name] = (offset, len(data))
+            index_offset = f.tell()
+            f.write(json.dumps(self.index).encode())
+            f.write(TRAILER.pack(index_offset))
+            f.write(MAGIC)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _map(self):
+        if self._mmap is None:
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        return self._mmap
+
+    def load(self, name, map_location='cpu'):
+        if name not in self.index:
+            self.refresh()
+        offset, size = self.index[name]
+        buffer = self._map()
+        if is_mapped(buffer, offset):
+            return mapped_checkpoint(*read_mapped(buffer, offset, map_location))
+        return torch.load(io.BytesIO(buffer[offset:offset + size]), map_location=map_location)
+
+    def close(self):
+        # Tensors loaded from the mapping keep it alive
+        self._mmap = None
+
+
+_archives = {}
+
+
+def mapped_checkpoint(state_dict, metadata):
+    """A mapped checkpoint in the form torch.load returns for the other files."""
+    return dict(metadata, state_dict=state_dict) if metadata else state_dict
+
+
+def load_checkpoint(path, map_location='cpu'):
+    """
+    torch.load of a checkpoint file or of "<archive>#<name>". Memory-mapped
+    checkpoints are mapped instead of read.
+    """
+    if ARCHIVE_SEPARATOR in path:
+        archive_path, name = path.rsplit(ARCHIVE_SEPARATOR, 1)
+        if archive_path not in _archives:
+            _archives[archive_path] = CheckpointArchive(archive_path)
+        return _archives[archive_path].load(name, map_location)
+    with open(path, 'rb') as f:
+        mapped = is_mapped(f.read(ALIGNMENT))
+    if mapped:
+        return mapped_checkpoint(*load_mapped(path, map_location))
+    return torch.load(path, map_location=map_location)
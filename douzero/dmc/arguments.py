@@ -1,5 +1,7 @@
 import argparse
 
+from .inference import INFERENCE_MODES, REFRESH_UPDATES
+
 parser = argparse.ArgumentParser(description='DouZero: PyTorch DouDizhu AI')
 
 # General Settings
@@ -7,6 +9,8 @@ parser.add_argument('--xpid', default='AlphaDou',
                     help='Experiment id (default: AlphaDou)')
 parser.add_argument('--save_interval_frames', default=1999999, type=int,
                     help='Time interval (in minutes) at which to save the model')    
+parser.add_argument('--wild_mode', action='store_true',
+                    help='Play with a random wild card (laizi) rank in every game')
 parser.add_argument('--objective', default='adp', type=str, choices=['adp'],
                     help='Use ADP as reward (default: ADP)')
 
@@ -19,14 +23,66 @@ parser.add_argument('--num_actor_devices', default=1, type=int,
                     help='The number of devices used for simulation')
 parser.add_argument('--num_actors', default=4, type=int,
                     help='The number of actors for each simulation device')
+parser.add_argument('--actor_threads', default=1, type=int,
+                    help='Actor threads per actor process sharing one model (1 means one actor per process)')
+parser.add_argument('--actor_batch_wait_ms', default=1., type=float,
+                    help='How long the actor threads of a process wait for each other to batch a forward pass')
+parser.add_argument('--actor_inference', default='eager', type=str,
+                    choices=INFERENCE_MODES,
+                    help='How the actors run the value networks (falls back to eager on failure)')
+parser.add_argument('--inference_refresh', default=REFRESH_UPDATES, type=int,
+                    help='Learner updates after which the script, fold and int8 copies of the weights are rebuilt. '
+                         'Lower values act on fresher weights, but every rebuild stalls the actor for about a '
+                         'second, which only pays off over a few hundred decisions')
 parser.add_argument('--training_device', default='0', type=str,
                     help='The index of the GPU used for training models. `cpu` means using cpu')
+parser.add_argument('--play_model', default='resnet', type=str, choices=['resnet', 'split', 'transformer'],
+                    help='Network of the play positions: resnet, split to encode the state once per decision, '
+                         'or transformer')
+parser.add_argument('--play_preset', default='', type=str, choices=['', 'full', 'medium', 'small', 'tiny'],
+                    help='Widths of the resnet or split play network (see STUDENT_PRESETS)')
+parser.add_argument('--model_config', default='', type=str,
+                    help='JSON file or string of architecture overrides per group, '
+                         'e.g. \'{"play": {"blocks": 2, "se": false}}\'')
 parser.add_argument('--load_model', action='store_true',
                     help='Load an existing model')
 parser.add_argument('--disable_checkpoint', action='store_true',
                     help='Disable saving checkpoint')
+parser.add_argument('--keep_last', default=0, type=int,
+                    help='Keep the position checkpoints of only the last N saves (0: keep all)')
+parser.add_argument('--keep_every_frames', default=0, type=int,
+                    help='Also keep the first save after every multiple of this many frames')
+parser.add_argument('--keep_best', default=0, type=int,
+                    help='Also keep the N saves with the best score in --eval_scores, and the saves '
+                         'newer than the newest scored one')
+parser.add_argument('--eval_scores', default='', type=str,
+                    help='Evaluation CSV with model_id and score columns, e.g. of auto_test.py')
+parser.add_argument('--archive_pruned', action='store_true',
+                    help='Pack pruned checkpoints into checkpoints.ckpa in the experiment directory')
+parser.add_argument('--max_actor_restarts', default=100, type=int,
+                    help='How many times a crashed actor is restarted (-1 means no limit)')
 parser.add_argument('--savedir', default='douzero_checkpoints',
                     help='Root dir where experiment data will be saved')
+parser.add_argument('--log_flush_rows', default=256, type=int,
+                    help='Write the buffered rows of logs.csv once this many are buffered')
+parser.add_argument('--log_flush_secs', default=10., type=float,
+                    help='Write the buffered rows of logs.csv at least this often (seconds)')
+parser.add_argument('--log_max_bytes', default=0, type=int,
+                    help='Rotate logs.csv to logs.<n>.csv at this size (0: never)')
+parser.add_argument('--log_npz', action='store_true',
+                    help='Also write the logged rows as npz chunks (see file_writer.read_npz_logs)')
+parser.add_argument('--metrics_port', default=0, type=int,
+                    help='Serve Prometheus metrics on this port (0: off)')
+parser.add_argument('--metrics_host', default='127.0.0.1', type=str,
+                    help='Address of the metrics endpoint')
+parser.add_argument('--trace_dir', default='', type=str,
+                    help='Record a Chrome trace of the actors and learners into this directory')
+parser.add_argument('--trace_sample', default=1., type=float,
+                    help='Share of the actor decisions and learner steps that are traced')
+parser.add_argument('--trace_start', default=0., type=float,
+                    help='Seconds after the start of every process before tracing')
+parser.add_argument('--trace_duration', default=60., type=float,
+                    help='Seconds of tracing per process (0: until the end)')
 
 # Hyperparameters
 parser.add_argument('--total_frames', default=100000000000, type=int,
@@ -45,10 +101,40 @@ parser.add_argument('--batch_size', default=30, type=int,
                     help='Learner batch size')
 parser.add_argument('--unroll_length', default=100, type=int,
                     help='The unroll length (time dimension)')
+parser.add_argument('--position_batch_size', default='', type=str,
+                    help='Per-position batch sizes, e.g. `bid=4,landlord=30` (bid/play select three positions)')
+parser.add_argument('--position_unroll_length', default='', type=str,
+                    help='Per-position unroll lengths, e.g. `bid=10`, falls back to --unroll_length')
+parser.add_argument('--adaptive_batch_size', action='store_true',
+                    help='Resize each position batch to keep update rates similar across positions')
+parser.add_argument('--target_update_interval', default=0., type=float,
+                    help='Seconds between updates targeted by --adaptive_batch_size '
+                         '(0 follows the busiest position)')
 parser.add_argument('--num_buffers', default=50, type=int,
                     help='Number of shared-memory buffers')
 parser.add_argument('--num_threads', default=1, type=int,
                     help='Number learner threads')
+parser.add_argument('--prefetch_batches', default=1, type=int,
+                    help='Batches assembled ahead of the learner for each position (0 disables prefetching)')
+parser.add_argument('--pin_memory', action='store_true',
+                    help='Prefetch batches into pinned memory (GPU training only)')
+parser.add_argument('--replay_capacity', default=0, type=int,
+                    help='Samples kept in a replay store per position (0 trains on every sample once)')
+parser.add_argument('--replay_policy', default='fifo', type=str, choices=['fifo', 'reservoir'],
+                    help='Which samples the replay store keeps when it is full')
+parser.add_argument('--replay_ratio', default=1., type=float,
+                    help='Learner batches drawn from the replay store per fresh batch')
+parser.add_argument('--bf16', action='store_true',
+                    help='Run the learner and actor forward passes under bfloat16 autocast')
+parser.add_argument('--fused_learner', action='store_true',
+                    help='Train the positions that share an architecture in one batched step')
+parser.add_argument('--learner_processes', action='store_true',
+                    help='Run the learner of every position in its own process')
+parser.add_argument('--queue_size', default=64, type=int,
+                    help='Max rollouts waiting in each position queue (0 means unbounded)')
+parser.add_argument('--queue_policy', default='block', type=str,
+                    choices=['block', 'drop_oldest', 'drop_newest'],
+                    help='What actors do when a position queue is full')
 parser.add_argument('--max_grad_norm', default=40., type=float,
                     help='Max norm of gradients')
 
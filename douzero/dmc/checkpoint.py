@@ -0,0 +1,202 @@
+"""
+Position checkpoints (e.g. landlord_0.ckpt) hold the weights of one
+network with its architecture (see `create_model`), so they are loaded
+without knowing how the network was configured. Files that hold only
+the weights get their architecture inferred from them.
+
+Training checkpoints are written by `CheckpointWriter` in a background
+thread. Every file is written to a temporary file first and renamed
+over the target, so a crash during a write never leaves a truncated
+checkpoint behind. A `RetentionPolicy` then prunes the position
+checkpoints of older saves.
+"""
+import csv
+import logging
+import os
+import re
+import threading
+import timeit
+
+import torch
+
+from . import tracing
+from .archive import CheckpointArchive, load_checkpoint
+from .models import create_model, infer_arch
+
+POSITIONS = ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']
+POSITION_FILE = re.compile(r'^(%s)_(\d+)\.ckpt$' % '|'.join(POSITIONS))
+
+log = logging.getLogger('doudzero')
+
+
+def atomic_save(obj, path):
+    # A hidden name, so that watchers of the checkpoint directory (e.g.
+    # auto_test.py) never pick up the file while it is written
+    directory, name = os.path.split(path)
+    tmp = os.path.join(directory, '.' + name + '.tmp')
+    torch.save(obj, tmp)
+    os.replace(tmp, path)
+
+
+def to_cpu(obj):
+    """A copy of `obj` (e.g. a model or optimizer state dict) with every tensor on the CPU."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def save_position(path, state_dict, arch):
+    atomic_save(dict(arch=arch, state_dict=state_dict), path)
+
+
+def unpack_position(obj):
+    """(state_dict, arch) of a loaded position checkpoint."""
+    if isinstance(obj, dict) and 'arch' in obj and 'state_dict' in obj:
+        return obj['state_dict'], obj['arch']
+    return obj, infer_arch(obj)
+
+
+def load_position(path, map_location='cpu'):
+    return unpack_position(load_checkpoint(path, map_location))
+
+
+def load_position_model(path, map_location='cpu'):
+    """The network of a position checkpoint, in eval mode."""
+    state_dict, arch = load_position(path, map_location)
+    model = create_model(arch)
+    model.load_state_dict(state_dict)
+    return model.eval()
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints in a background thread so that the learners only
+    wait for the snapshot of the weights. `submit` takes a list of
+    (object, path) pairs, which must not be modified afterwards. If a
+    checkpoint is submitted while the previous one is still waiting to
+    be written, only the newer one is written. `after_write` is called
+    in the writer thread after every checkpoint, e.g. to prune older
+    ones.
+    """
+    def __init__(self, after_write=None):
+        self.after_write = after_write
+        self.writes = 0
+        self.skipped = 0
+        self.last_duration = 0.
+        self._pending = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, files):
+        with self._cond:
+            if self._pending is not None:
+                self.skipped += 1
+                log.warning('Checkpoint writes are slower than the save interval, skipping an older checkpoint')
+            self._pending = files
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                files, self._pending = self._pending, None
+            start = timeit.default_timer()
+            try:
+                for obj, path in files:
+                    atomic_save(obj, path)
+            except Exception:
+                log.exception('Writing checkpoint %s failed', files[0][1])
+                continue
+            end = timeit.default_timer()
+            self.last_duration = end - start
+            tracing.record('checkpoint_write', start, end, path=files[0][1])
+            self.writes += 1
+            log.info('Wrote checkpoint %s and %d more files in %.2fs',
+                     files[0][1], len(files) - 1, self.last_duration)
+            if self.after_write is not None:
+                try:
+                    self.after_write()
+                except Exception:
+                    log.exception('Pruning checkpoints failed')
+
+    def close(self):
+        """Write the pending checkpoint and stop the thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+
+def read_scores(path):
+    """model_id -> score of an evaluation CSV such as the ones of auto_test.py."""
+    scores = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            scores[int(float(row['model_id']))] = float(row['score'])
+    return scores
+
+
+class RetentionPolicy:
+    """
+    Which saves (frame counts) of position checkpoints to keep: the
+    `keep_last` newest, the first save at or after every multiple of
+    `keep_every_frames`, and the `keep_best` saves with the highest
+    score in the `scores` CSV. With `keep_best` the saves newer than
+    the newest scored one are kept as well, so that they are not pruned
+    before the evaluator gets to them. The newest save is always kept.
+    Pruned saves are appended to `archive` (a checkpoint archive path)
+    first, if given.
+    """
+    def __init__(self, keep_last=0, keep_every_frames=0, keep_best=0, scores='', archive=''):
+        self.keep_last = keep_last
+        self.keep_every_frames = keep_every_frames
+        self.keep_best = keep_best
+        self.scores = scores
+        self.archive = CheckpointArchive(archive) if archive else None
+
+    def enabled(self):
+        return bool(self.keep_last or self.keep_every_frames or self.keep_best)
+
+    def kept(self, saves):
+        saves = sorted(saves)
+        keep = set(saves[-max(self.keep_last, 1):])
+        if self.keep_every_frames:
+            first = {}
+            for frames in saves:
+                first.setdefault(frames // self.keep_every_frames, frames)
+            keep.update(first.values())
+        if self.keep_best and self.scores:
+            scores = read_scores(self.scores) if os.path.exists(self.scores) else {}
+            scored = sorted((f for f in saves if f in scores), key=lambda f: scores[f], reverse=True)
+            keep.update(scored[:self.keep_best])
+            newest_scored = max(scored, default=-1)
+            keep.update(f for f in saves if f > newest_scored)
+        return keep
+
+    def apply(self, directory):
+        """Prune the position checkpoints in `directory`. Returns the pruned saves."""
+        saves = {}
+        for name in os.listdir(directory):
+            match = POSITION_FILE.match(name)
+            if match:
+                saves.setdefault(int(match.group(2)), []).append(name)
+        pruned = sorted(set(saves) - self.kept(saves))
+        for frames in pruned:
+            paths = {name[:-len('.ckpt')]: os.path.join(directory, name) for name in saves[frames]}
+            if self.archive is not None:
+                self.archive.append(paths)
+            for path in paths.values():
+                os.remove(path)
+        if pruned:
+            log.info('Pruned the checkpoints of %d saves%s', len(pruned),
+                     ' into %s' % self.archive.path if self.archive is not None else '')
+        return pruned
@@ -1,8 +1,11 @@
+import contextlib
+import copy
 import os
 import threading
 import time
 import timeit
 import pprint
+import queue
 from collections import deque
 import numpy as np
 
@@ -11,9 +14,19 @@ from torch import multiprocessing as mp
 from torch import nn
 
 from .file_writer import FileWriter
-from .models import Model
-
-from .utils import get_batch, log, create_env, create_optimizers, act
+from .metrics import TrainingMetrics, per_position, serve_metrics
+from . import tracing
+from .models import Model, model_arch, position_group
+from .checkpoint import CheckpointWriter, RetentionPolicy, to_cpu
+from .queues import BatchQueue, queue_stats
+from .actor_stats import ActorStats, format_actor_stats
+from .supervisor import ActorSupervisor
+from .actor_threads import act_threads
+from .learners import LearnerStats
+from .fused import FUSED_GROUPS, can_fuse, fused_values
+
+from .utils import log, create_env, create_optimizer, create_optimizers, act, \
+    get_batch_sizes, AdaptiveBatchScheduler, create_batch_source, flatten_batch, autocast
 
 mean_episode_return_buf = {p: deque(maxlen=50) for p in
                            ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']}
@@ -36,53 +49,190 @@ def compute_loss_bid(logits, targets):
     return loss
 
 
-def learn(position, actor_models, model, batch, optimizer, flags, lock):
-    """Performs a learning (optimization) step."""
-    print("Learn", position)
-    if flags.training_device != "cpu":
-        device = torch.device('cuda:' + str(flags.training_device))
+def compute_position_loss(position, values, target_adp, target_wp, target_wp_bid):
+    win_rate, win, lose = values
+    if position in ["landlord", "landlord_up", "landlord_down"]:
+        loss1 = compute_loss(win_rate, target_wp)
+        l_w = compute_loss_(win, target_adp) * (1. + target_wp) / 2.
+        l_l = compute_loss_(lose, target_adp) * (1. - target_wp) / 2.
+        loss2 = l_w.mean() + l_l.mean()
+        loss = loss1 + loss2
     else:
-        device = torch.device('cpu')
-    obs_x = batch["obs_x_batch"]
-    obs_x = torch.flatten(obs_x, 0, 1).to(device)
-    obs_z = torch.flatten(batch['obs_z'].to(device), 0, 1).float()
-    target_adp = torch.flatten(batch['target_adp'].to(device), 0, 1)
-    target_wp = torch.flatten(batch['target_wp'].to(device), 0, 1)
-    target_wp_bid = torch.flatten(batch['target_wp_bid'].to(device), 0, 1)
+        loss1 = compute_loss_bid(win_rate, target_wp_bid)
+        l_w = compute_loss_(win, target_adp) * torch.abs(target_wp) * (1. + target_wp) / 2.
+        l_l = compute_loss_(lose, target_adp) * torch.abs(target_wp) * (1. - target_wp) / 2.
+        loss2 = l_w.mean() + l_l.mean()
+        loss = loss1 + loss2
+    return loss
+
+
+def get_training_device(flags):
+    if flags.training_device != "cpu":
+        return torch.device('cuda:' + str(flags.training_device))
+    return torch.device('cpu')
+
+
+def prepare_batch(position, batch, device):
+    """
+    Move a batch to the training device and record its episode returns.
+    Returns the inputs and the targets of the loss.
+    """
+    # Prefetched batches arrive already flattened to (T*B, ...)
+    if batch['done'].dim() > 1:
+        batch = flatten_batch(batch)
+    obs_x = batch["obs_x_batch"].to(device, non_blocking=True)
+    obs_z = batch['obs_z'].to(device, non_blocking=True).float()
+    target_adp = batch['target_adp'].to(device, non_blocking=True)
+    target_wp = batch['target_wp'].to(device, non_blocking=True)
+    target_wp_bid = batch['target_wp_bid'].to(device, non_blocking=True)
     episode_returns = batch['episode_return'][batch['done']]
     if len(episode_returns) > 0:
         mean_episode_return_buf[position].append(torch.mean(episode_returns).to(device))
-    with lock:
-        win_rate, win, lose = model.forward(obs_z, obs_x, return_value=True)['values']
-
-        if position in ["landlord", "landlord_up", "landlord_down"]:
-            loss1 = compute_loss(win_rate, target_wp)
-            l_w = compute_loss_(win, target_adp) * (1. + target_wp) / 2.
-            l_l = compute_loss_(lose, target_adp) * (1. - target_wp) / 2.
-            loss2 = l_w.mean() + l_l.mean()
-            loss = loss1 + loss2
-        else:
-            loss1 = compute_loss_bid(win_rate, target_wp_bid)
-            l_w = compute_loss_(win, target_adp) * torch.abs(target_wp) * (1. + target_wp) / 2.
-            l_l = compute_loss_(lose, target_adp) * torch.abs(target_wp) * (1. - target_wp) / 2.
-            loss2 = l_w.mean() + l_l.mean()
-            loss = loss1 + loss2
-
-        stats = {
-            'mean_episode_return_' + position: torch.mean(
-                torch.stack([_r for _r in mean_episode_return_buf[position]])).item(),
-            'loss_' + position: loss.item(),
-        }
+    return obs_z, obs_x, (target_adp, target_wp, target_wp_bid)
+
+
+def position_stats(position, loss, actor_models, batch):
+    # Policy lag: learner updates published since the weights that
+    # produced the samples of this batch
+    version = next(iter(actor_models.values())).get_version(position)
+    stats = {
+        'loss_' + position: loss.item(),
+        'policy_lag_' + position: (version - batch['version'].double()).mean().item(),
+    }
+    # The buffer stays empty until a batch contains a finished episode
+    if len(mean_episode_return_buf[position]) > 0:
+        stats['mean_episode_return_' + position] = torch.mean(
+            torch.stack([_r for _r in mean_episode_return_buf[position]])).item()
+    return stats
+
+
+def learn(position, actor_models, model, batch, optimizer, flags, lock):
+    """Performs a learning (optimization) step."""
+    print("Learn", position)
+    device = get_training_device(flags)
+    obs_z, obs_x, targets = prepare_batch(position, batch, device)
+    with lock, tracing.span('learn', position=position):
+        with autocast(flags, device):
+            values = model.forward(obs_z, obs_x, return_value=True)['values']
+        loss = compute_position_loss(position, values, *targets)
+
+        stats = position_stats(position, loss, actor_models, batch)
         optimizer.zero_grad()
         loss.backward()
         nn.utils.clip_grad_norm_(model.parameters(), flags.max_grad_norm)
         optimizer.step()
 
-        for actor_model in actor_models.values():
-            actor_model.get_model(position).load_state_dict(model.state_dict())
+        with tracing.span('weight_sync', position=position):
+            for actor_model in actor_models.values():
+                actor_model.get_model(position).load_state_dict(model.state_dict())
+                actor_model.bump_version(position)
+        return stats
+
+
+def learn_fused(positions, actor_models, models, batches, optimizers, flags, locks):
+    """
+    One learning step for several positions whose networks share an
+    architecture. Their forward and backward passes run as one batched
+    call; the loss, gradient clipping and optimizer of every position
+    stay separate. Falls back to one `learn` call per position when the
+    networks or the batch shapes differ.
+    """
+    fused_models = [models[p] for p in positions]
+    if not can_fuse(fused_models, [batches[p] for p in positions]):
+        stats = {}
+        for p in positions:
+            stats.update(learn(p, actor_models, models[p], batches[p], optimizers[p], flags, locks[p]))
+        return stats
+    log.debug('Learn %s', ' '.join(positions))
+    device = get_training_device(flags)
+    inputs = [prepare_batch(p, batches[p], device) for p in positions]
+    with contextlib.ExitStack() as stack:
+        for p in positions:
+            stack.enter_context(locks[p])
+        stack.enter_context(tracing.span('learn', position=' '.join(positions)))
+        with autocast(flags, device):
+            values = fused_values(fused_models, [z for z, _, _ in inputs], [x for _, x, _ in inputs])
+        losses = [compute_position_loss(p, v, *targets) for p, v, (_, _, targets) in zip(positions, values, inputs)]
+
+        stats = {}
+        for p, loss in zip(positions, losses):
+            stats.update(position_stats(p, loss, actor_models, batches[p]))
+            optimizers[p].zero_grad()
+        # The positions do not share parameters, so the gradient of the
+        # sum is the gradient of every loss on its own network
+        sum(losses).backward()
+        for p in positions:
+            nn.utils.clip_grad_norm_(models[p].parameters(), flags.max_grad_norm)
+            optimizers[p].step()
+            with tracing.span('weight_sync', position=p):
+                for actor_model in actor_models.values():
+                    actor_model.get_model(p).load_state_dict(models[p].state_dict())
+                    actor_model.bump_version(p)
         return stats
 
 
+def learner_process(position, batch_queues, actor_models, learner_stats, requests, responses,
+                    flags, checkpointpath):
+    """
+    Process target of --learner_processes. Trains the network of one
+    position and publishes its weights to the shared actor models
+    after every step, like the learner threads do. The main thread
+    answers checkpoint requests from the main process.
+    """
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // len(learner_stats.positions)))
+    tracing.configure(flags, 'learner-%s' % position)
+    training_device = get_training_device(flags)
+    # The actor models already hold the initial (or resumed) weights
+    model = copy.deepcopy(next(iter(actor_models.values())).get_model(position)).to(training_device)
+    model.train()
+    optimizer = create_optimizer(flags, model.parameters())
+    if flags.load_model and os.path.exists(checkpointpath):
+        checkpoint_states = torch.load(checkpointpath, map_location=training_device)
+        optimizer.load_state_dict(checkpoint_states["optimizer_state_dict"][position])
+        del checkpoint_states
+    position_lock = threading.Lock()
+
+    def batch_and_learn(next_batch):
+        while learner_stats.total_frames() < flags.total_frames:
+            tracing.begin_step()
+            start = timeit.default_timer()
+            batch = next_batch()
+            learn_start = timeit.default_timer()
+            _stats = learn(position, actor_models, model, batch, optimizer, flags, position_lock)
+            learner_stats.record(position, batch['done'].numel(), _stats,
+                                 timeit.default_timer() - learn_start, learn_start - start)
+
+    threads = []
+    for device in actor_models:
+        next_batch = create_batch_source(batch_queues[device][position], position, flags, threading.Lock(),
+                                         lambda: learner_stats.batch_size(position))
+        for i in range(flags.num_threads):
+            thread = threading.Thread(target=batch_and_learn, name='batch-and-learn-%s-%d' % (position, i),
+                                      args=(next_batch,), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    parent = mp.parent_process()
+    while all(thread.is_alive() for thread in threads):
+        try:
+            request = requests.get(timeout=1)
+        except queue.Empty:
+            # Do not outlive a main process that was killed
+            if parent is not None and not parent.is_alive():
+                return
+            continue
+        except KeyboardInterrupt:
+            return
+        if request is None:
+            return
+        with position_lock:
+            model_state = to_cpu(model.state_dict())
+            optimizer_state = to_cpu(optimizer.state_dict())
+        responses.put((position, model_state, optimizer_state))
+    if learner_stats.total_frames() < flags.total_frames:
+        raise RuntimeError('Learner thread of %s died' % position)
+
+
 def train(flags):
     """
     This is the main funtion for training. It will first
@@ -94,16 +244,28 @@ def train(flags):
         if not torch.cuda.is_available():
             raise AssertionError(
                 "CUDA not available. If you have GPUs, please specify the ID after `--gpu_devices`. Otherwise, please train with CPU with `python3 train.py --actor_device_cpu --training_device cpu`")
+    tracing.configure(flags, 'train')
     plogger = FileWriter(
         xpid=flags.xpid,
         xp_args=flags.__dict__,
         rootdir=flags.savedir,
+        flush_rows=flags.log_flush_rows,
+        flush_secs=flags.log_flush_secs,
+        max_bytes=flags.log_max_bytes,
+        npz=flags.log_npz,
     )
     checkpointpath = os.path.expandvars(
         os.path.expanduser('%s/%s/%s' % (flags.savedir, flags.xpid, 'model.tar')))
 
-    T = flags.unroll_length
-    B = flags.batch_size
+    assert not (flags.fused_learner and flags.learner_processes), \
+        '--fused_learner trains several positions in one thread and can not be used with --learner_processes'
+
+    # Batch sizes are read by the learner threads on every step and may
+    # be resized by the adaptive scheduler
+    batch_sizes = get_batch_sizes(flags)
+    batch_scheduler = None
+    if flags.adaptive_batch_size:
+        batch_scheduler = AdaptiveBatchScheduler(batch_sizes, flags.target_update_interval)
 
     if flags.actor_device_cpu:
         device_iterator = ['cpu']
@@ -113,9 +275,10 @@ def train(flags):
             flags.gpu_devices.split(',')), 'The number of actor devices can not exceed the number of available devices'
 
     # Initialize actor models
+    arch = model_arch(flags)
     models = {}
     for device in device_iterator:
-        model = Model(device=device)
+        model = Model(device=device, arch=arch)
         model.share_memory()
         model.eval()
         models[device] = model
@@ -125,9 +288,8 @@ def train(flags):
     ctx = mp.get_context('spawn')
     batch_queues = {}
     for device in device_iterator:
-        batch_queue = {"first": ctx.SimpleQueue(), "second": ctx.SimpleQueue(), "third": ctx.SimpleQueue(),
-                       "landlord": ctx.SimpleQueue(), "landlord_up": ctx.SimpleQueue(),
-                       "landlord_down": ctx.SimpleQueue()}
+        batch_queue = {p: BatchQueue(ctx, maxsize=flags.queue_size, policy=flags.queue_policy)
+                       for p in ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']}
         batch_queues[device] = batch_queue
 
     # Stat Keys
@@ -144,73 +306,173 @@ def train(flags):
         'loss_landlord_up',
         'mean_episode_return_landlord_down',
         'loss_landlord_down',
+        'policy_lag_first',
+        'policy_lag_second',
+        'policy_lag_third',
+        'policy_lag_landlord',
+        'policy_lag_landlord_up',
+        'policy_lag_landlord_down',
     ]
     frames, stats = 0, {k: 0 for k in stat_keys}
     position_frames = {'first': 0, 'second': 0, 'third': 0, 'landlord': 0, 'landlord_up': 0, 'landlord_down': 0}
 
-    def batch_and_learn(i, device, position, local_lock, position_lock, lock=threading.Lock()):
-        """Thread target for the learning process."""
-        nonlocal frames, position_frames, stats
-        global save_mark
-
-        # Learner model for training
-        learner_model = Model(device=flags.training_device)
-
-        # Create optimizers
+    position_steps = {'first': 0, 'second': 0, 'third': 0, 'landlord': 0, 'landlord_up': 0, 'landlord_down': 0}
+    # Seconds the learners of every position spent waiting for a batch
+    # and running learner steps
+    position_idle = {'first': 0., 'second': 0., 'third': 0., 'landlord': 0., 'landlord_up': 0., 'landlord_down': 0.}
+    position_busy = {'first': 0., 'second': 0., 'third': 0., 'landlord': 0., 'landlord_up': 0., 'landlord_down': 0.}
+
+    # One learner model shared by all learner threads. Every thread only
+    # touches the network and optimizer of its own position, under the
+    # lock of that position. With --learner_processes the networks live
+    # in the learner processes instead.
+    learner_model, optimizers = None, None
+    if not flags.learner_processes:
+        learner_model = Model(device=flags.training_device, arch=arch)
         optimizers = create_optimizers(flags, learner_model)
+    position_locks = {'first': threading.Lock(), 'second': threading.Lock(), 'third': threading.Lock(),
+                      'landlord': threading.Lock(), 'landlord_up': threading.Lock(), 'landlord_down': threading.Lock()}
 
-        # Load models if any
-        if flags.load_model and os.path.exists(checkpointpath):
-            checkpoint_states = torch.load(
-                checkpointpath,
-                map_location=("cuda:" + str(flags.training_device) if flags.training_device != "cpu" else "cpu")
-            )
-
-            for k in ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']:
+    # Load models if any
+    if flags.load_model and os.path.exists(checkpointpath):
+        checkpoint_states = torch.load(
+            checkpointpath,
+            map_location=("cuda:" + str(flags.training_device) if flags.training_device != "cpu" else "cpu")
+        )
+        # Checkpoints of older runs have the default architecture
+        if checkpoint_states.get('arch', arch) != arch:
+            raise ValueError('The checkpoint architecture %s differs from the configured %s'
+                             % (checkpoint_states['arch'], arch))
+
+        for k in ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']:
+            if learner_model is not None:
                 learner_model.get_model(k).load_state_dict(checkpoint_states["model_state_dict"][k])
                 optimizers[k].load_state_dict(checkpoint_states["optimizer_state_dict"][k])
-                for de in device_iterator:
-                    models[de].get_model(k).load_state_dict(checkpoint_states["model_state_dict"][k])
-            stats = checkpoint_states["stats"]
-            frames = checkpoint_states["frames"]
-            position_frames = checkpoint_states["position_frames"]
-            log.info(f"Resuming preempted job, current stats:\n{stats}")
-
-        def checkpoint(frames):
-            global save_mark
-            if flags.disable_checkpoint:
-                return
-            log.info('Saving checkpoint to %s', checkpointpath)
-            _models = learner_model.get_models()
-            torch.save({
-                'model_state_dict': {k: _models[k].state_dict() for k in _models},
-                'optimizer_state_dict': {k: optimizers[k].state_dict() for k in optimizers},
-                "stats": stats,
-                'flags': vars(flags),
-                'frames': frames,
-                'position_frames': position_frames
-            }, checkpointpath)
-            save_mark = frames
-            # Save the weights for evaluation purpose
-            for position in ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']:
-                model_weights_dir = os.path.expandvars(os.path.expanduser(
-                    '%s/%s/%s' % (flags.savedir, flags.xpid, position + '_' + str(frames) + '.ckpt')))
-                torch.save(learner_model.get_model(position).state_dict(), model_weights_dir)
-
+            for de in device_iterator:
+                models[de].get_model(k).load_state_dict(checkpoint_states["model_state_dict"][k])
+        # Checkpoints of older runs may miss some of the stat keys
+        stats.update(checkpoint_states["stats"])
+        frames = checkpoint_states["frames"]
+        position_frames = checkpoint_states["position_frames"]
+        log.info(f"Resuming preempted job, current stats:\n{stats}")
+
+    # Learner processes, one per position
+    learner_stats, learner_procs = None, {}
+    if flags.learner_processes:
+        learner_stats = LearnerStats(position_frames.keys(), batch_sizes)
+        for n, p in enumerate(learner_stats.positions):
+            learner_stats.frames[n] = position_frames[p]
+        for position in learner_stats.positions:
+            requests, responses = ctx.Queue(), ctx.Queue()
+            process = ctx.Process(
+                target=learner_process, name='learner-%s' % position,
+                args=(position, batch_queues, models, learner_stats, requests, responses, flags, checkpointpath),
+                daemon=True)
+            process.start()
+            learner_procs[position] = (process, requests, responses)
+
+    def snapshot_learners():
+        if learner_procs:
+            for process, requests, responses in learner_procs.values():
+                requests.put(True)
+            model_states, optimizer_states = {}, {}
+            for process, requests, responses in learner_procs.values():
+                position, model_state, optimizer_state = responses.get()
+                model_states[position] = model_state
+                optimizer_states[position] = optimizer_state
+            return model_states, optimizer_states
+        # Copy every position under its own lock so that the snapshot
+        # never contains a half-applied optimizer step
+        model_states, optimizer_states = {}, {}
+        for k in position_locks:
+            with position_locks[k]:
+                model_states[k] = to_cpu(learner_model.get_model(k).state_dict())
+                optimizer_states[k] = to_cpu(optimizers[k].state_dict())
+        return model_states, optimizer_states
+
+    retention = RetentionPolicy(
+        flags.keep_last, flags.keep_every_frames, flags.keep_best, flags.eval_scores,
+        os.path.join(os.path.dirname(checkpointpath), 'checkpoints.ckpa') if flags.archive_pruned else '')
+    checkpoint_writer = CheckpointWriter(
+        lambda: retention.apply(os.path.dirname(checkpointpath)) if retention.enabled() else None)
+
+    checkpoint_snapshot = 0.
+
+    def checkpoint(frames):
+        """
+        Snapshot the weights and stats, and leave writing them to the
+        checkpoint writer thread.
+        """
+        global save_mark
+        nonlocal checkpoint_snapshot
+        if flags.disable_checkpoint:
+            return
+        start = timeit.default_timer()
+        with tracing.span('checkpoint_snapshot', frames=frames):
+            model_states, optimizer_states = snapshot_learners()
+        files = [({
+            'model_state_dict': model_states,
+            'arch': arch,
+            'optimizer_state_dict': optimizer_states,
+            "stats": dict(stats),
+            'flags': vars(flags),
+            'frames': frames,
+            'position_frames': dict(position_frames)
+        }, checkpointpath)]
+        # Save the weights for evaluation purpose
+        for position in ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']:
+            model_weights_dir = os.path.expandvars(os.path.expanduser(
+                '%s/%s/%s' % (flags.savedir, flags.xpid, position + '_' + str(frames) + '.ckpt')))
+            files.append((dict(arch=arch[position_group(position)], state_dict=model_states[position]),
+                          model_weights_dir))
+        checkpoint_writer.submit(files)
+        save_mark = frames
+        checkpoint_snapshot = timeit.default_timer() - start
+        log.info('Saving checkpoint to %s (snapshot took %.3fs, last write %.2fs)',
+                 checkpointpath, checkpoint_snapshot, checkpoint_writer.last_duration)
+
+    stats_lock = threading.Lock()
+
+    def record_step(position, batch, _stats, idle, busy):
+        nonlocal frames, position_frames, stats
+        with stats_lock:
+            for k in _stats:
+                stats[k] = _stats[k]
+            to_log = dict(frames=frames)
+            to_log.update({k: stats[k] for k in stat_keys})
+            plogger.log(to_log)
+            frames += batch['done'].numel()
+            position_frames[position] += batch['done'].numel()
+            position_steps[position] += 1
+            position_idle[position] += idle
+            position_busy[position] += busy
+            if frames - save_mark > flags.save_interval_frames:
+                checkpoint(frames)
+
+    def batch_and_learn(i, device, position, next_batch, position_lock):
+        """Thread target for the learning process."""
         while frames < flags.total_frames:
-            batch = get_batch(batch_queues[device][position], position, flags, local_lock)
+            tracing.begin_step()
+            start = timeit.default_timer()
+            batch = next_batch()
+            learn_start = timeit.default_timer()
             _stats = learn(position, models, learner_model.get_model(position), batch,
                            optimizers[position], flags, position_lock)
-            with lock:
-                for k in _stats:
-                    stats[k] = _stats[k]
-                to_log = dict(frames=frames)
-                to_log.update({k: stats[k] for k in stat_keys})
-                plogger.log(to_log)
-                frames += T * B
-                position_frames[position] += T * B
-                if frames - save_mark > flags.save_interval_frames:
-                    checkpoint(frames)
+            record_step(position, batch, _stats, learn_start - start, timeit.default_timer() - learn_start)
+
+    def fused_batch_and_learn(i, device, positions, batch_sources):
+        """Thread target of --fused_learner, trains a group of positions together."""
+        while frames < flags.total_frames:
+            tracing.begin_step()
+            start = timeit.default_timer()
+            batches = {p: batch_sources[p]() for p in positions}
+            learn_start = timeit.default_timer()
+            _stats = learn_fused(positions, models, learner_model.get_models(), batches,
+                                 optimizers, flags, position_locks)
+            # The time of the fused step is shared by its positions
+            busy = (timeit.default_timer() - learn_start) / len(positions)
+            for p in positions:
+                record_step(p, batches[p], _stats, learn_start - start, busy)
 
     threads = []
     locks = {}
@@ -218,37 +480,79 @@ def train(flags):
         locks[device] = {'first': threading.Lock(), 'second': threading.Lock(), 'third': threading.Lock(),
                          'landlord': threading.Lock(), 'landlord_up': threading.Lock(),
                          'landlord_down': threading.Lock()}
-    position_locks = {'first': threading.Lock(), 'second': threading.Lock(), 'third': threading.Lock(),
-                      'landlord': threading.Lock(), 'landlord_up': threading.Lock(), 'landlord_down': threading.Lock()}
 
-    for device in device_iterator:
-        for i in range(flags.num_threads):
-            for position in ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']:
-                thread = threading.Thread(
-                    target=batch_and_learn, name='batch-and-learn-%d' % i,
-                    args=(i, device, position, locks[device][position], position_locks[position]))
-                thread.start()
-                threads.append(thread)
-
-    # Starting actor processes
-    for device in device_iterator:
+    if not flags.learner_processes:
+        for device in device_iterator:
+            batch_sources = {p: create_batch_source(batch_queues[device][p], p, flags, locks[device][p],
+                                                    lambda p=p: batch_sizes[p])
+                             for p in ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']}
+            for i in range(flags.num_threads):
+                if flags.fused_learner:
+                    for positions in FUSED_GROUPS:
+                        thread = threading.Thread(
+                            target=fused_batch_and_learn, name='fused-batch-and-learn-%d' % i,
+                            args=(i, device, positions, batch_sources))
+                        thread.start()
+                        threads.append(thread)
+                    continue
+                for position in ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']:
+                    thread = threading.Thread(
+                        target=batch_and_learn, name='batch-and-learn-%d' % i,
+                        args=(i, device, position, batch_sources[position], position_locks[position]))
+                    thread.start()
+                    threads.append(thread)
+
+    # Starting actor processes. With --actor_threads > 1 every process
+    # runs that many actor threads sharing one model.
+    threads_per_actor = max(flags.actor_threads, 1)
+    actor_stats = ActorStats(len(device_iterator) * flags.num_actors * threads_per_actor)
+    supervisor = ActorSupervisor(ctx, act_threads if threads_per_actor > 1 else act, flags)
+    for device_index, device in enumerate(device_iterator):
         num_actors = flags.num_actors
         for i in range(flags.num_actors):
-            actor = ctx.Process(
-                target=act,
-                args=(i, device, batch_queues[device], models[device], flags))
-            actor.start()
+            first_row = (device_index * flags.num_actors + i) * threads_per_actor
+            recorders = [actor_stats.recorder(first_row + k) for k in range(threads_per_actor)]
+            actor = supervisor.start(
+                device, i, (i, device, batch_queues[device], models[device], flags,
+                            recorders if threads_per_actor > 1 else recorders[0]))
             actor_processes.append(actor)
 
+    metrics = None
+    if flags.metrics_port:
+        metrics = TrainingMetrics()
+        serve_metrics(metrics, flags.metrics_port, flags.metrics_host)
+        log.info('Serving metrics on http://%s:%d/metrics', flags.metrics_host, flags.metrics_port)
+
     fps_log = []
     timer = timeit.default_timer
     try:
-        last_checkpoint_time = timer() - flags.save_interval * 60
+        last_queue_stats = queue_stats(batch_queues, position_frames.keys())
+        last_actor_stats = actor_stats.snapshot()
         while frames < flags.total_frames:
             start_frames = frames
             position_start_frames = {k: position_frames[k] for k in position_frames}
+            start_steps = {k: position_steps[k] for k in position_steps}
+            start_idle = {k: position_idle[k] for k in position_idle}
+            start_busy = {k: position_busy[k] for k in position_busy}
             start_time = timer()
             time.sleep(5)
+            supervisor.check()
+
+            if learner_procs:
+                dead = [p for p in learner_procs if not learner_procs[p][0].is_alive()]
+                if dead:
+                    raise RuntimeError('Learner process(es) died: %s' % ', '.join(dead))
+                position_frames = learner_stats.position_frames()
+                position_steps = learner_stats.position_steps()
+                position_idle = learner_stats.position_idle()
+                position_busy = learner_stats.position_busy()
+                frames = sum(position_frames.values())
+                stats.update(learner_stats.stats())
+                to_log = dict(frames=frames)
+                to_log.update({k: stats[k] for k in stat_keys})
+                plogger.log(to_log)
+                if frames - save_mark > flags.save_interval_frames:
+                    checkpoint(frames)
 
             end_time = timer()
 
@@ -260,23 +564,106 @@ def train(flags):
 
             position_fps = {k: (position_frames[k] - position_start_frames[k]) / (end_time - start_time) for k in
                             position_frames}
-            log.info('After %i (L:%i U:%i D:%i) frames: @ %.1f fps (avg@ %.1f fps) (L:%.1f U:%.1f D:%.1f) Stats:\n%s',
+            log.info('After %i (F:%i S:%i T:%i L:%i U:%i D:%i) frames: @ %.1f fps (avg@ %.1f fps) '
+                     '(F:%.1f S:%.1f T:%.1f L:%.1f U:%.1f D:%.1f) Stats:\n%s',
                      frames,
+                     position_frames['first'],
+                     position_frames['second'],
+                     position_frames['third'],
                      position_frames['landlord'],
                      position_frames['landlord_up'],
                      position_frames['landlord_down'],
                      fps,
                      fps_avg,
+                     position_fps['first'],
+                     position_fps['second'],
+                     position_fps['third'],
                      position_fps['landlord'],
                      position_fps['landlord_up'],
                      position_fps['landlord_down'],
                      pprint.pformat(stats))
 
+            cur_queue_stats = queue_stats(batch_queues, position_frames.keys())
+            if batch_scheduler is not None:
+                batch_scheduler.update(
+                    {k: cur_queue_stats[k]['puts'] - last_queue_stats[k]['puts'] for k in cur_queue_stats},
+                    end_time - start_time)
+                if learner_stats is not None:
+                    learner_stats.set_batch_sizes(batch_sizes)
+                log.info('Batch sizes: %s', ' '.join('%s:%d' % (k, batch_sizes[k]) for k in batch_sizes))
+            log.info('Queues (depth/put_wait/get_wait/drops per %.0fs): %s',
+                     end_time - start_time,
+                     ' '.join('%s:%d/%.2fs/%.2fs/%d' % (
+                         k,
+                         cur_queue_stats[k]['depth'],
+                         cur_queue_stats[k]['put_wait'] - last_queue_stats[k]['put_wait'],
+                         cur_queue_stats[k]['get_wait'] - last_queue_stats[k]['get_wait'],
+                         cur_queue_stats[k]['drops'] - last_queue_stats[k]['drops'])
+                         for k in cur_queue_stats))
+            last_queue_stats = cur_queue_stats
+            # Idle is the share of learner time spent waiting for batches
+            # over the steps finished in this interval
+            idle = {k: position_idle[k] - start_idle[k] for k in position_idle}
+            busy = {k: position_busy[k] - start_busy[k] for k in position_busy}
+            log.info('Learner steps/s and idle (%s): %s', 'processes' if learner_procs else 'threads',
+                     ' '.join('%s:%.2f/%.0f%%' % (
+                         k,
+                         (position_steps[k] - start_steps[k]) / (end_time - start_time),
+                         100. * idle[k] / (idle[k] + busy[k]) if idle[k] + busy[k] > 0 else 0.)
+                         for k in position_steps))
+
+            cur_actor_stats = actor_stats.snapshot()
+            log.info('Actors (%d alive, %d crashes): %s', supervisor.num_alive(), supervisor.crashes(),
+                     format_actor_stats(cur_actor_stats, last_actor_stats, end_time - start_time))
+            last_actor_stats = cur_actor_stats
+
+            if metrics is not None:
+                positions = list(position_frames)
+                metrics.update([
+                    ('frames_total', 'counter', 'Environment frames trained on', frames),
+                    ('position_frames_total', 'counter', 'Frames trained on per position',
+                     per_position(position_frames)),
+                    ('fps', 'gauge', 'Frames per second over the last interval', fps),
+                    ('position_fps', 'gauge', 'Frames per second per position', per_position(position_fps)),
+                    ('learner_steps_total', 'counter', 'Learner steps per position', per_position(position_steps)),
+                    ('learner_idle_ratio', 'gauge', 'Share of learner time spent waiting for batches',
+                     per_position({k: idle[k] / (idle[k] + busy[k]) if idle[k] + busy[k] > 0 else 0.
+                                   for k in positions})),
+                    ('loss', 'gauge', 'Last loss', per_position({k: stats['loss_' + k] for k in positions})),
+                    ('mean_episode_return', 'gauge', 'Mean episode return',
+                     per_position({k: stats['mean_episode_return_' + k] for k in positions})),
+                    ('policy_lag', 'gauge', 'Weight versions between acting and training on a sample',
+                     per_position({k: stats['policy_lag_' + k] for k in positions})),
+                    ('queue_depth', 'gauge', 'Batches waiting in the learner queues',
+                     per_position({k: cur_queue_stats[k]['depth'] for k in positions})),
+                    ('queue_drops_total', 'counter', 'Batches dropped by the learner queues',
+                     per_position({k: cur_queue_stats[k]['drops'] for k in positions})),
+                    ('actors_alive', 'gauge', 'Actor processes alive', supervisor.num_alive()),
+                    ('actor_crashes_total', 'counter', 'Actor process crashes', supervisor.crashes()),
+                    ('actor_games_total', 'counter', 'Games finished by the actors',
+                     cur_actor_stats['counters']['games']),
+                    ('checkpoint_snapshot_seconds', 'gauge', 'Duration of the last checkpoint snapshot',
+                     checkpoint_snapshot),
+                    ('checkpoint_write_seconds', 'gauge', 'Duration of the last checkpoint write',
+                     checkpoint_writer.last_duration),
+                    ('checkpoint_writes_total', 'counter', 'Checkpoints written', checkpoint_writer.writes),
+                ])
+
     except KeyboardInterrupt:
-        return
+        log.info('Interrupted after %d frames, shutting down.', frames)
     else:
         for thread in threads:
             thread.join()
         log.info('Learning finished after %d frames.', frames)
-
-    plogger.close()
+    finally:
+        # Also on interrupts, so that the pending checkpoint and log rows
+        # are written and no actor or learner process is left behind
+        for process, requests, responses in learner_procs.values():
+            requests.put(None)
+            process.join()
+        supervisor.stop()
+        checkpoint_writer.close()
+        if flags.trace_dir:
+            tracing.close()
+            log.info('Merged traces into %s', tracing.merge_traces(flags.trace_dir))
+        plogger.close()
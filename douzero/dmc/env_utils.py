@@ -3,6 +3,7 @@ Here, we wrap the original environment to make it easier
 to use. When a game is finished, instead of mannualy reseting
 the environment, we do it automatically.
 """
+import timeit
 import numpy as np
 import torch
 
@@ -32,10 +33,19 @@ class Environment:
         self.env = env
         self.device = device
         self.episode_return = None
+        self._format_time = 0.
+
+    @property
+    def encode_time(self):
+        """ Seconds spent building and formatting observations
+        """
+        return getattr(self.env, 'encode_time', 0.) + self._format_time
 
     def initial(self, model, device, flags=None):
         obs = self.env.reset(model, device, flags=flags)
+        start = timeit.default_timer()
         initial_position, initial_obs, x_no_action, z = _format_observation(obs, self.device)
+        self._format_time += timeit.default_timer() - start
         initial_reward = torch.zeros(1, 1)
         self.episode_return = torch.zeros(1, 1)
         initial_done = torch.ones(1, 1, dtype=torch.bool)
@@ -58,7 +68,9 @@ class Environment:
         if draw:
             obs = self.env.reset(model, device, flags=flags)
             self.episode_return = torch.zeros(1, 1)
+        start = timeit.default_timer()
         position, obs, x_no_action, z = _format_observation(obs, self.device)
+        self._format_time += timeit.default_timer() - start
         # reward = torch.tensor(reward).view(1, 1)
         done = torch.tensor(done).view(1, 1)
         draw = torch.tensor(draw).view(1, 1)
@@ -0,0 +1,118 @@
+"""
+Inference-only export of the networks. In eval mode a BatchNorm after a
+convolution is a per-channel affine transform, so it is folded into
+the weights and bias of the convolution and replaced by an identity.
+Exported files hold the folded weights with the name of the network
+class and, for the networks of `create_model`, their architecture.
+`load_exported` rebuilds the folded network from them.
+"""
+import copy
+import importlib
+
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+# (convolution, batch norm) attribute pairs applied as bn(conv(x))
+FOLD_PAIRS = [('conv1', 'bn1'), ('conv2', 'bn2'), ('conv', 'bn1')]
+
+# Networks that can be exported. The two GeneralModelBid classes differ,
+# so the classes are named with their module.
+EXPORT_ARCHS = [
+    'douzero.dmc.models.GeneralModelResnet',
+    'douzero.dmc.models.GeneralModelSplit',
+    'douzero.dmc.models.GeneralModelBid',
+    'douzero.dmc.models.GeneralModelTransformer',
+    'douzero.dmc.models_res.ResnetModel',
+    'douzero.dmc.models_res.GeneralModelBid',
+]
+
+CONV_TYPES = (nn.Conv1d, nn.Conv2d)
+BN_TYPES = (nn.BatchNorm1d, nn.BatchNorm2d)
+
+
+def fold_batchnorm(model):
+    """
+    Fold every batch norm that directly follows a convolution into it,
+    in place. `model` must be in eval mode. Returns `model`.
+    """
+    if model.training:
+        raise ValueError('Batch norm can only be folded in eval mode')
+    for module in model.modules():
+        for conv_name, bn_name in FOLD_PAIRS:
+            conv, bn = getattr(module, conv_name, None), getattr(module, bn_name, None)
+            if isinstance(conv, CONV_TYPES) and isinstance(bn, BN_TYPES):
+                setattr(module, conv_name, fuse_conv_bn_eval(conv, bn))
+                setattr(module, bn_name, nn.Identity())
+        # Shortcuts are nn.Sequential(conv, bn)
+        if isinstance(module, nn.Sequential) and len(module) == 2 \
+                and isinstance(module[0], CONV_TYPES) and isinstance(module[1], BN_TYPES):
+            module[0] = fuse_conv_bn_eval(module[0], module[1])
+            module[1] = nn.Identity()
+    return model
+
+
+def arch_name_of(cls):
+    return '%s.%s' % (cls.__module__, cls.__qualname__)
+
+
+def arch_name(model):
+    return arch_name_of(type(model))
+
+
+def arch_class(arch):
+    if arch not in EXPORT_ARCHS:
+        raise ValueError('Unknown network: %s' % arch)
+    module, name = arch.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def arch_kwargs(arch, state_dict):
+    """Constructor arguments of `arch` for `state_dict`, e.g. the widths of a student."""
+    if arch.startswith('douzero.dmc.models.'):
+        from .models import MODEL_TYPES, infer_arch
+        kwargs = infer_arch(state_dict)
+        if arch_name_of(MODEL_TYPES[kwargs.pop('type')]) == arch:
+            return kwargs
+    return {}
+
+
+def detect_arch(state_dict):
+    """The network class a training state dict belongs to."""
+    for arch in EXPORT_ARCHS:
+        try:
+            arch_class(arch)(**arch_kwargs(arch, state_dict)).load_state_dict(state_dict)
+        except (RuntimeError, KeyError):
+            continue
+        return arch
+    raise ValueError('The state dict does not match any exportable network')
+
+
+def export_model(model, config=None):
+    """
+    The inference-only form of `model`: its folded weights, the name of
+    its class and `config`, the architecture it was built from with
+    `create_model`, to be saved with `torch.save`.
+    """
+    folded = fold_batchnorm(copy.deepcopy(model).eval())
+    return dict(inference_only=True, arch=arch_name(model), config=config, state_dict=folded.state_dict())
+
+
+def is_exported(obj):
+    return isinstance(obj, dict) and obj.get('inference_only', False)
+
+
+def load_exported(exported):
+    """
+    Rebuild the folded network, in eval mode, from `export_model` output.
+    The network takes over the loaded tensors, e.g. memory-mapped ones.
+    """
+    arch, state_dict = exported['arch'], exported['state_dict']
+    if exported.get('config'):
+        from .models import create_model
+        model = create_model(exported['config'])
+    else:
+        # Files exported without the architecture
+        model = arch_class(arch)(**arch_kwargs(arch, state_dict))
+    model = fold_batchnorm(model.eval())
+    model.load_state_dict(state_dict, assign=True)
+    return model
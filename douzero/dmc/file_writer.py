@@ -13,15 +13,20 @@
 # limitations under the License.
 
 
+import atexit
 import copy
 import datetime
 import csv
+import glob
 import json
 import logging
 import os
+import threading
 import time
 from typing import Dict
 
+import numpy as np
+
 # import git
 
 
@@ -59,10 +64,23 @@ from typing import Dict
 
 
 class FileWriter:
+    """
+    Writes the rows passed to `log` to logs.csv. Rows are buffered in
+    memory and written by a background thread once `flush_rows` rows
+    are buffered or `flush_secs` seconds have passed, so `log` never
+    touches the disk. With `max_bytes` logs.csv is rotated to
+    logs.<n>.csv once it grows past that size. With `npz` every flush
+    also writes its rows as one array per field to
+    npz/logs_<time of the first row>.npz, see `read_npz_logs`.
+    """
     def __init__(self,
                  xpid: str = None,
                  xp_args: dict = None,
-                 rootdir: str = '~/palaas'):
+                 rootdir: str = '~/palaas',
+                 flush_rows: int = 256,
+                 flush_secs: float = 10.,
+                 max_bytes: int = 0,
+                 npz: bool = False):
         if not xpid:
             # make unique id
             xpid = '{proc}_{unixtime}'.format(
@@ -142,47 +160,122 @@ class FileWriter:
                 self.fieldnames = list(reader)[0]
         else:
             self.fieldnames = ['_tick', '_time']
+        self._written_fields = len(self.fieldnames)
+
+        self.flush_rows = flush_rows
+        self.flush_secs = flush_secs
+        self.max_bytes = max_bytes
+        self.npz = npz
+        if npz:
+            self.paths['npz'] = '{base}/npz'.format(base=self.basepath)
+            os.makedirs(self.paths['npz'], exist_ok=True)
+        self._rows = []
+        self._lock = threading.Lock()
+        # Only one thread writes at a time, rows stay in order
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='file-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
 
     def log(self, to_log: Dict, tick: int = None,
             verbose: bool = False) -> None:
-        if tick is not None:
-            raise NotImplementedError
-        else:
-            to_log['_tick'] = self._tick
-            self._tick += 1
-        to_log['_time'] = time.time()
-
-        old_len = len(self.fieldnames)
-        for k in to_log:
-            if k not in self.fieldnames:
-                self.fieldnames.append(k)
-        if old_len != len(self.fieldnames):
-            with open(self.paths['fields'], 'w') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(self.fieldnames)
-            self._logger.info('Updated log fields: %s', self.fieldnames)
-
-        if to_log['_tick'] == 0:
-            # print("\ncreating logs file ")
-            with open(self.paths['logs'], 'a') as f:
-                f.write('# %s\n' % ','.join(self.fieldnames))
+        with self._lock:
+            if tick is not None:
+                raise NotImplementedError
+            else:
+                to_log['_tick'] = self._tick
+                self._tick += 1
+            to_log['_time'] = time.time()
+
+            old_len = len(self.fieldnames)
+            for k in to_log:
+                if k not in self.fieldnames:
+                    self.fieldnames.append(k)
+            if old_len != len(self.fieldnames):
+                self._logger.info('Updated log fields: %s', self.fieldnames)
+            self._rows.append(dict(to_log))
+            if len(self._rows) >= self.flush_rows:
+                self._wake.set()
 
         if verbose:
             self._logger.info('LOG | %s', ', '.join(
                 ['{}: {}'.format(k, to_log[k]) for k in sorted(to_log)]))
 
-        with open(self.paths['logs'], 'a') as f:
-            writer = csv.DictWriter(f, fieldnames=self.fieldnames)
-            writer.writerow(to_log)
-            # print("\nadded to log file")
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_secs if self.flush_secs > 0 else None)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                self._logger.exception('Writing logs failed')
+
+    def flush(self) -> None:
+        """Write the buffered rows."""
+        with self._write_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                fieldnames = list(self.fieldnames)
+            if not rows:
+                return
+            if len(fieldnames) != self._written_fields:
+                with open(self.paths['fields'], 'w') as csvfile:
+                    writer = csv.writer(csvfile)
+                    writer.writerow(fieldnames)
+                self._written_fields = len(fieldnames)
+            if self.max_bytes and os.path.exists(self.paths['logs']) \
+                    and os.path.getsize(self.paths['logs']) >= self.max_bytes:
+                self._rotate()
+            with open(self.paths['logs'], 'a') as f:
+                if rows[0]['_tick'] == 0 or f.tell() == 0:
+                    f.write('# %s\n' % ','.join(fieldnames))
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writerows(rows)
+            if self.npz:
+                # Named by time, ticks start over when a run is resumed
+                np.savez(os.path.join(self.paths['npz'], 'logs_%017.6f.npz' % rows[0]['_time']),
+                         **{k: np.array([_number(row.get(k)) for row in rows]) for k in fieldnames})
+
+    def _rotate(self) -> None:
+        n = 1
+        while os.path.exists('{base}/logs.{n}.csv'.format(base=self.basepath, n=n)):
+            n += 1
+        os.replace(self.paths['logs'], '{base}/logs.{n}.csv'.format(base=self.basepath, n=n))
 
     def close(self, successful: bool = True) -> None:
         # self.metadata['date_end'] = datetime.datetime.now().strftime(
         #     '%Y-%m-%d %H:%M:%S.%f')
         # self.metadata['successful'] = successful
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
         self._save_metadata()
 
     def _save_metadata(self) -> None:
         with open(self.paths['meta'], 'w') as jsonfile:
             pass
             # json.dump(self.metadata, jsonfile, indent=4, sort_keys=True)
+
+
+def _number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def read_npz_logs(basepath: str) -> Dict[str, np.ndarray]:
+    """
+    The rows written with `npz` in `basepath` (e.g. savedir/xpid) as one
+    array per field. Fields missing from older chunks are NaN.
+    """
+    chunks = [np.load(path) for path in sorted(glob.glob(os.path.join(basepath, 'npz', 'logs_*.npz')))]
+    fields = []
+    for chunk in chunks:
+        fields += [k for k in chunk.files if k not in fields]
+    return {k: np.concatenate([chunk[k] if k in chunk.files else np.full(len(chunk['_tick']), np.nan)
+                               for chunk in chunks]) if chunks else np.array([])
+            for k in fields}
@@ -0,0 +1,60 @@
+"""
+Batched forward pass over several networks of the same architecture,
+used by --fused_learner. The parameters of the networks are stacked
+and the network is run once under `torch.func.vmap`, so every position
+still sees only its own weights and its own batch. Stacking is done
+with differentiable ops, so `backward` fills the gradients of the
+original parameters.
+"""
+import torch
+from torch.func import functional_call, vmap
+
+# Positions trained together by the fused learner
+FUSED_GROUPS = [
+    ['first', 'second', 'third'],
+    ['landlord', 'landlord_up', 'landlord_down'],
+]
+
+BATCH_KEYS = ['obs_z', 'obs_x_batch', 'target_adp', 'target_wp', 'target_wp_bid']
+
+
+def can_fuse(models, batches):
+    """
+    Whether `models` can be run as one batched call on `batches`: the
+    networks must have the same class and parameter shapes, and the
+    batches the same shapes (e.g. not with different batch sizes).
+    Networks with a false `fusable` attribute are never fused.
+    """
+    first = models[0]
+    if not getattr(first, 'fusable', True):
+        return False
+    shapes = [(n, p.shape) for n, p in first.named_parameters()]
+    for model in models[1:]:
+        if type(model) is not type(first) or [(n, p.shape) for n, p in model.named_parameters()] != shapes:
+            return False
+    for key in BATCH_KEYS:
+        if any(batch[key].shape != batches[0][key].shape for batch in batches[1:]):
+            return False
+    return True
+
+
+def fused_values(models, zs, xs):
+    """
+    Run `values` of every model on its own inputs in one call. Returns
+    the (win_rate, win, lose) of every model. The running statistics of
+    the batch norm layers are updated like in separate calls.
+    """
+    names = [n for n, _ in models[0].named_parameters()]
+    buffer_names = [n for n, _ in models[0].named_buffers()]
+    params = {n: torch.stack([model.get_parameter(n) for model in models]) for n in names}
+    buffers = {n: torch.stack([model.get_buffer(n) for model in models]) for n in buffer_names}
+
+    def values(params, buffers, z, x):
+        return functional_call(models[0], (params, buffers), (z, x), kwargs=dict(return_value=True))['values']
+
+    values = vmap(values, randomness='different')(params, buffers, torch.stack(zs), torch.stack(xs))
+    with torch.no_grad():
+        for n in buffer_names:
+            for k, model in enumerate(models):
+                model.get_buffer(n).copy_(buffers[n][k])
+    return [tuple(v[k] for v in values) for k in range(len(models))]
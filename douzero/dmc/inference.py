@@ -0,0 +1,166 @@
+"""
+Inference-only paths for the value networks. `values` is pure tensor
+math (action selection with its Python control flow is done separately
+by `select_action`), so it can be scripted and frozen, traced or
+compiled with torch.compile, run with its batch norms folded into the
+convolutions, or with int8 dynamic quantization of its linear layers
+(after folding) on CPU. A network whose path can not be built, or
+fails when called, falls back to eager mode with a warning.
+"""
+import copy
+import logging
+import timeit
+
+import torch
+from torch import nn
+
+from .export import fold_batchnorm
+
+log = logging.getLogger('doudzero')
+
+INFERENCE_MODES = ['eager', 'script', 'trace', 'compile', 'fold', 'int8']
+
+# Paths that hold a copy of the weights and are rebuilt as they get stale
+COPY_MODES = ['script', 'fold', 'int8']
+# Learner updates between rebuilds of those copies. A script+freeze
+# build of a play network takes about a second on one CPU and saves a
+# few ms per decision, so rebuilding much more often costs the actors
+# more than the faster path saves.
+REFRESH_UPDATES = 200
+
+
+class _Values(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, z, x):
+        return self.model.values(z, x)
+
+
+def quantizable_linears(model):
+    """
+    Names of the linear layers of `model` for int8 dynamic quantization.
+    Transformer layers read the weights of their linear layers directly,
+    so those are left in float.
+    """
+    skip = [n + '.' for n, m in model.named_modules()
+            if isinstance(m, (nn.TransformerEncoderLayer, nn.MultiheadAttention))]
+    return {n for n, m in model.named_modules()
+            if isinstance(m, nn.Linear) and not any(n.startswith(p) for p in skip)}
+
+
+def build_values(model, mode, z, x):
+    """
+    Build the `mode` path of `model.values` from the example inputs
+    `z` and `x` and check it against eager mode. int8 outputs are not
+    expected to match, see the action agreement of benchmark.py.
+    """
+    if mode == 'eager':
+        return model.values
+    if mode == 'int8':
+        quantized = torch.ao.quantization.quantize_dynamic(
+            fold_batchnorm(copy.deepcopy(model).eval()), quantizable_linears(model), dtype=torch.qint8)
+        return quantized.values
+    wrapper = _Values(model).eval()
+    with torch.no_grad():
+        if mode == 'script':
+            values = torch.jit.freeze(torch.jit.script(wrapper))
+        elif mode == 'trace':
+            values = torch.jit.trace(wrapper, (z, x), check_trace=False)
+        elif mode == 'compile':
+            values = torch.compile(wrapper, dynamic=True)
+        elif mode == 'fold':
+            values = fold_batchnorm(copy.deepcopy(model).eval()).values
+        else:
+            raise ValueError('Unknown inference mode: %s' % mode)
+        expected = model.values(z, x)
+        for a, b in zip(values(z, x), expected):
+            if not torch.allclose(a, b, rtol=1e-3, atol=1e-4):
+                raise RuntimeError('%s output differs from eager mode' % mode)
+    return values
+
+
+class CompiledValues:
+    """
+    `values` and `select_action` of one network through an inference
+    path. The path is built on the first call. Frozen graphs, folded
+    and quantized models hold a copy of the weights, so with
+    `get_version` they are rebuilt once the weights are `refresh`
+    updates old. Also keeps the call count and time for latency
+    reports.
+    """
+    def __init__(self, model, mode='eager', refresh=REFRESH_UPDATES, get_version=None, name=''):
+        self.model = model
+        self.mode = mode
+        self.refresh = refresh
+        self.get_version = get_version
+        self.name = name
+        self.calls = 0
+        self.time = 0.
+        self._values = None
+        self._version = None
+
+    def _fallback(self, error):
+        log.warning('%s inference failed for %s, falling back to eager mode: %s', self.mode, self.name, error)
+        self.mode = 'eager'
+        self._values = self.model.values
+
+    def values(self, z, x):
+        start = timeit.default_timer()
+        if self.mode in COPY_MODES and self.get_version is not None and self._values is not None:
+            if self.get_version() - self._version >= self.refresh:
+                self._values = None
+        if self._values is None:
+            try:
+                self._version = self.get_version() if self.get_version is not None else 0
+                self._values = build_values(self.model, self.mode, z, x)
+            except Exception as e:
+                self._fallback(e)
+        try:
+            out = self._values(z, x)
+        except Exception as e:
+            if self.mode == 'eager':
+                raise
+            self._fallback(e)
+            out = self._values(z, x)
+        self.calls += 1
+        self.time += timeit.default_timer() - start
+        return out
+
+    def select_action(self, win_rate, win, lose, z, flags=None):
+        return self.model.select_action(win_rate, win, lose, z, flags)
+
+    def forward(self, z, x, return_value=False, flags=None):
+        win_rate, win, lose = self.values(z, x)
+        if return_value:
+            return dict(values=(win_rate, win, lose))
+        return self.select_action(win_rate, win, lose, z, flags)
+
+    def latency(self):
+        return self.time / self.calls if self.calls else 0.
+
+
+class InferenceModel:
+    """
+    Replacement for `Model` in the actors that runs every position
+    through `CompiledValues`. Copies of the weights are refreshed from
+    the shared weights as the learner publishes updates.
+    """
+    def __init__(self, model, mode='eager', refresh=REFRESH_UPDATES):
+        self.model = model
+        self.models = {
+            p: CompiledValues(m, mode, refresh, get_version=lambda p=p: model.get_version(p), name=p)
+            for p, m in model.get_models().items()}
+
+    def forward(self, position, z, x, training=False, flags=None, debug=False):
+        return self.models[position].forward(z, x, flags=flags)
+
+    def get_model(self, position):
+        return self.models[position]
+
+    def get_models(self):
+        return self.models
+
+    def get_version(self, position):
+        return self.model.get_version(position)
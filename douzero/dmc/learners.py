@@ -0,0 +1,90 @@
+"""
+Shared state of the per-position learner processes used with
+--learner_processes. Every learner process owns one row of the
+shared tensors; the main process only reads them for frame
+accounting and logging, and writes the batch sizes chosen by the
+adaptive scheduler.
+"""
+import math
+import threading
+
+import torch
+
+
+class LearnerStats:
+    def __init__(self, positions, batch_sizes):
+        self.positions = list(positions)
+        n = len(self.positions)
+        self.frames = torch.zeros(n, dtype=torch.int64).share_memory_()
+        self.steps = torch.zeros(n, dtype=torch.int64).share_memory_()
+        self.learn_time = torch.zeros(n, dtype=torch.float64).share_memory_()
+        self.idle_time = torch.zeros(n, dtype=torch.float64).share_memory_()
+        self.loss = torch.full((n,), math.nan, dtype=torch.float64).share_memory_()
+        self.mean_episode_return = torch.full((n,), math.nan, dtype=torch.float64).share_memory_()
+        self.policy_lag = torch.full((n,), math.nan, dtype=torch.float64).share_memory_()
+        self.batch_sizes = torch.tensor([batch_sizes[p] for p in self.positions], dtype=torch.int64).share_memory_()
+        # Only guards the threads of one learner process, so it is
+        # created again after unpickling
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def total_frames(self):
+        return int(self.frames.sum())
+
+    def batch_size(self, position):
+        return int(self.batch_sizes[self.positions.index(position)])
+
+    def set_batch_sizes(self, batch_sizes):
+        for n, p in enumerate(self.positions):
+            self.batch_sizes[n] = batch_sizes[p]
+
+    def record(self, position, frames, stats, elapsed, idle=0.):
+        """
+        Add one learner step of `frames` frames that took `elapsed`
+        seconds after waiting `idle` seconds for its batch. `stats` is
+        the dict returned by `learn`.
+        """
+        n = self.positions.index(position)
+        with self._lock:
+            self.frames[n] += frames
+            self.steps[n] += 1
+            self.learn_time[n] += elapsed
+            self.idle_time[n] += idle
+            self.loss[n] = stats['loss_' + position]
+            self.policy_lag[n] = stats['policy_lag_' + position]
+            if 'mean_episode_return_' + position in stats:
+                self.mean_episode_return[n] = stats['mean_episode_return_' + position]
+
+    def position_frames(self):
+        return dict(zip(self.positions, self.frames.tolist()))
+
+    def position_steps(self):
+        return dict(zip(self.positions, self.steps.tolist()))
+
+    def position_idle(self):
+        return dict(zip(self.positions, self.idle_time.tolist()))
+
+    def position_busy(self):
+        return dict(zip(self.positions, self.learn_time.tolist()))
+
+    def stats(self):
+        """
+        Latest learner stats in the format of the thread mode. Positions
+        that have not reported yet are left out.
+        """
+        stats = {}
+        for n, p in enumerate(self.positions):
+            if not math.isnan(self.loss[n]):
+                stats['loss_' + p] = float(self.loss[n])
+                stats['policy_lag_' + p] = float(self.policy_lag[n])
+            if not math.isnan(self.mean_episode_return[n]):
+                stats['mean_episode_return_' + p] = float(self.mean_episode_return[n])
+        return stats
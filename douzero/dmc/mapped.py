@@ -0,0 +1,81 @@
+"""
+Memory-mapped checkpoints for evaluation. The tensors are stored raw
+and aligned after a JSON header, so a loader maps the file and wraps
+the tensors around the mapping without reading or copying them. All
+evaluation workers that map the same file share its pages in the page
+cache instead of each holding a private copy of the weights.
+
+    [MAGIC][header size][header JSON][padding][tensor data]
+
+The header holds the dtype, shape and data offset of every tensor and
+the metadata of the checkpoint, e.g. the architecture of a position
+checkpoint or the class of an exported network. Files are recognised
+by MAGIC, so they can keep the .ckpt extension.
+"""
+import json
+import mmap
+import os
+import struct
+
+import torch
+
+MAGIC = b'ADMAP01\n'
+HEADER_SIZE = struct.Struct('<Q')
+ALIGNMENT = 64
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_mapped(path, state_dict, metadata=None):
+    tensors, offset = {}, 0
+    for name, tensor in state_dict.items():
+        nbytes = tensor.numel() * tensor.element_size()
+        tensors[name] = [str(tensor.dtype).split('.')[-1], list(tensor.shape), offset, nbytes]
+        offset = _align(offset + nbytes)
+    header = json.dumps(dict(metadata=metadata or {}, tensors=tensors)).encode()
+    start = _align(len(MAGIC) + HEADER_SIZE.size + len(header))
+    directory, name = os.path.split(path)
+    tmp = os.path.join(directory, '.' + name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + HEADER_SIZE.pack(len(header)) + header)
+        for name, tensor in state_dict.items():
+            f.seek(start + tensors[name][2])
+            f.write(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp, path)
+
+
+def is_mapped(buffer, offset=0):
+    return bytes(buffer[offset:offset + len(MAGIC)]) == MAGIC
+
+
+def read_mapped(buffer, offset=0, map_location='cpu'):
+    """
+    (state_dict, metadata) of a mapped checkpoint at `offset` of
+    `buffer`, e.g. a writable (copy-on-write) mmap. On the CPU the
+    tensors are views of `buffer`.
+    """
+    header_at = offset + len(MAGIC)
+    size, = HEADER_SIZE.unpack(buffer[header_at:header_at + HEADER_SIZE.size])
+    header_at += HEADER_SIZE.size
+    header = json.loads(bytes(buffer[header_at:header_at + size]))
+    start = offset + _align(len(MAGIC) + HEADER_SIZE.size + size)
+    state_dict = {}
+    for name, (dtype, shape, data_offset, nbytes) in header['tensors'].items():
+        data = torch.frombuffer(buffer, dtype=torch.uint8, count=nbytes, offset=start + data_offset) \
+            if nbytes else torch.empty(0, dtype=torch.uint8)
+        tensor = data.view(getattr(torch, dtype)).reshape(shape)
+        state_dict[name] = tensor if map_location in (None, 'cpu') else tensor.to(map_location)
+    return state_dict, header['metadata']
+
+
+def load_mapped(path, map_location='cpu'):
+    """
+    (state_dict, metadata) of a mapped checkpoint file. The mapping is
+    private, so writes to the tensors stay in this process.
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return read_mapped(buffer, 0, map_location)
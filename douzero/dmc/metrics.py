@@ -0,0 +1,80 @@
+"""
+Optional Prometheus endpoint of the training process (--metrics_port).
+The main loop publishes the numbers it logs every few seconds with
+`TrainingMetrics.update`, which renders them to the Prometheus text
+format once. Scrapes only return the last rendered text, so they never
+touch the learner or stats locks.
+
+    curl http://127.0.0.1:<metrics_port>/metrics
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'alphadou_'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in labels)
+
+
+def render(families):
+    """
+    Prometheus text of `families`, a list of (name, type, help, samples)
+    where samples is a number or a dict of label tuples -> number, e.g.
+    {(('position', 'landlord'),): 1.5}.
+    """
+    lines = []
+    for name, kind, help, samples in families:
+        lines.append('# HELP %s%s %s' % (PREFIX, name, help))
+        lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        for labels, value in samples.items():
+            lines.append('%s%s%s %r' % (PREFIX, name, _labels(labels), float(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def per_position(values):
+    return {(('position', k),): v for k, v in values.items()}
+
+
+class TrainingMetrics:
+    def __init__(self):
+        self._text = render([])
+        self._lock = threading.Lock()
+
+    def update(self, families):
+        text = render(families)
+        with self._lock:
+            self._text = text
+
+    def text(self):
+        with self._lock:
+            return self._text
+
+
+def serve_metrics(metrics, port, host='127.0.0.1'):
+    """Serve `metrics` on http://host:port/metrics from a daemon thread. Returns the server."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
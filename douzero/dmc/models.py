@@ -2,7 +2,11 @@
 This file includes the torch models. We wrap the three
 models into one class for convenience.
 """
+import copy
+import json
 import math
+import os
+
 import numpy as np
 import torch.nn.functional as F
 import torch
@@ -30,7 +34,7 @@ class ChannelAttention(nn.Module):
 class BasicBlockM(nn.Module):
     expansion = 1
 
-    def __init__(self, in_planes, planes, stride=1):
+    def __init__(self, in_planes, planes, stride=1, se=True):
         super(BasicBlockM, self).__init__()
         self.conv1 = nn.Conv1d(in_planes, planes, kernel_size=3,
                                stride=stride, padding=1, bias=False)
@@ -39,7 +43,7 @@ class BasicBlockM(nn.Module):
         self.conv2 = nn.Conv1d(planes, planes, kernel_size=3,
                                stride=1, padding=1, bias=False)
         self.bn2 = nn.BatchNorm1d(planes)
-        self.se = ChannelAttention(planes)
+        self.se = ChannelAttention(planes) if se else nn.Identity()
         self.shortcut = nn.Sequential()
         if stride != 1 or in_planes != self.expansion * planes:
             self.shortcut = nn.Sequential(
@@ -58,23 +62,40 @@ class BasicBlockM(nn.Module):
         return out
 
 
+def distinct_runs(rows):
+    """
+    Splits `rows` into runs of equal consecutive rows, like the legal
+    actions of one decision that share a state. Returns the index of
+    the first row of every run and the run of every row.
+    """
+    new_run = torch.ones(rows.shape[0], dtype=torch.bool, device=rows.device)
+    new_run[1:] = (rows[1:] != rows[:-1]).flatten(1).any(dim=1)
+    return new_run.nonzero().flatten(), torch.cumsum(new_run.long(), dim=0) - 1
+
+
 class GeneralModelResnet(nn.Module):
-    def __init__(self):
+    """
+    `planes` are the channels of the three ResNet stages, `blocks` the
+    residual blocks per stage, `se` whether they have channel attention
+    and `hidden` the widths of the MLP. See `create_model`.
+    """
+    def __init__(self, planes=(72, 144, 288), hidden=(2048, 512, 128), blocks=3, se=True):
         super().__init__()
         self.in_planes = 72
-        self.layer1 = self._make_layer(BasicBlockM, 72, 3, stride=2)  # 1*27*72
-        self.layer2 = self._make_layer(BasicBlockM, 144, 3, stride=2)  # 1*14*146
-        self.layer3 = self._make_layer(BasicBlockM, 288, 3, stride=2)  # 1*7*292
-        self.linear1 = nn.Linear(288 * BasicBlockM.expansion * 7 + 18 * 4, 2048)
-        self.linear2 = nn.Linear(2048, 512)
-        self.linear3 = nn.Linear(512, 128)
-        self.linear4 = nn.Linear(128, 3)
+        self.se = se
+        self.layer1 = self._make_layer(BasicBlockM, planes[0], blocks, stride=2)  # 1*27*72
+        self.layer2 = self._make_layer(BasicBlockM, planes[1], blocks, stride=2)  # 1*14*146
+        self.layer3 = self._make_layer(BasicBlockM, planes[2], blocks, stride=2)  # 1*7*292
+        self.linear1 = nn.Linear(planes[2] * BasicBlockM.expansion * 7 + 18 * 4, hidden[0])
+        self.linear2 = nn.Linear(hidden[0], hidden[1])
+        self.linear3 = nn.Linear(hidden[1], hidden[2])
+        self.linear4 = nn.Linear(hidden[2], 3)
 
     def _make_layer(self, block, planes, num_blocks, stride):
         strides = [stride] + [1] * (num_blocks - 1)
         layers = []
         for stride in strides:
-            layers.append(block(self.in_planes, planes, stride))
+            layers.append(block(self.in_planes, planes, stride, self.se))
             self.in_planes = planes * block.expansion
         return nn.Sequential(*layers)
 
@@ -86,8 +107,12 @@ class GeneralModelResnet(nn.Module):
         else:
             return False
 
-    def forward(self, z, x, return_value=False, flags=None, debug=False):
-
+    def values(self, z, x):
+        """
+        The value heads only, without any action selection. Every row
+        is scored independently, so rows of different decisions can
+        share one call.
+        """
         out = self.layer1(z)
         out = self.layer2(out)
         out = self.layer3(out)
@@ -96,9 +121,17 @@ class GeneralModelResnet(nn.Module):
         out = F.leaky_relu_(self.linear1(out))
         out = F.leaky_relu_(self.linear2(out))
         out = F.leaky_relu_(self.linear3(out))
-        out = self.linear4(out)
+        # Back to float32 when running under bfloat16 autocast (--bf16)
+        out = self.linear4(out).float()
         win_rate, win, lose = torch.split(out, (1, 1, 1), dim=-1)
         win_rate = torch.tanh(win_rate)
+        return win_rate, win, lose
+
+    @torch.jit.unused
+    def select_action(self, win_rate, win, lose, z, flags=None):
+        """
+        Pick an action from the values of the legal actions of one decision.
+        """
         _win_rate = (win_rate + 1) / 2
         bombs = True
         if self.check_no_bombs(z[0, 2]) and self.check_no_bombs(z[0, 3]) and (0 in z[0, 11]):
@@ -107,46 +140,125 @@ class GeneralModelResnet(nn.Module):
         else:
             out = _win_rate * win + (1. - _win_rate) * lose
 
+        if flags is not None and flags.exp_epsilon > 0 and np.random.rand() < flags.exp_epsilon:
+            action = torch.randint(out.shape[0], (1,))[0]
+        elif flags is not None and flags.action_threshold > 0 and bombs:
+            max_adp = torch.max(out)
+            if max_adp >= 0:
+                min_threshold = max_adp * (1 - flags.action_threshold)
+            else:
+                min_threshold = max_adp * (1 + flags.action_threshold)
+            valid_indices = torch.where(out >= min_threshold)[0]
+            action = valid_indices[torch.argmax(_win_rate[valid_indices])]
+        else:
+            action = torch.argmax(out, dim=0)[0]
+        return dict(action=action, max_value=torch.max(out), values=out)
+
+    @torch.jit.unused
+    def forward(self, z, x, return_value=False, flags=None, debug=False):
+        win_rate, win, lose = self.values(z, x)
         if return_value:
             return dict(values=(win_rate, win, lose))
-        else:
-            if flags is not None and flags.exp_epsilon > 0 and np.random.rand() < flags.exp_epsilon:
-                action = torch.randint(out.shape[0], (1,))[0]
-            elif flags is not None and flags.action_threshold > 0 and bombs:
-                max_adp = torch.max(out)
-                if max_adp >= 0:
-                    min_threshold = max_adp * (1 - flags.action_threshold)
-                else:
-                    min_threshold = max_adp * (1 + flags.action_threshold)
-                valid_indices = torch.where(out >= min_threshold)[0]
-                action = valid_indices[torch.argmax(_win_rate[valid_indices])]
-            else:
-                action = torch.argmax(out, dim=0)[0]
-            return dict(action=action, max_value=torch.max(out), values=out)
+        return self.select_action(win_rate, win, lose, z, flags)
+
+
+class GeneralModelSplit(GeneralModelResnet):
+    """
+    GeneralModelResnet with the state encoded once per decision. Row 0
+    of `z` (the candidate action) is the only row that differs between
+    the legal actions of a decision, so the ResNet runs on the other 71
+    rows of every distinct state, and the action row goes through a
+    small MLP whose output is added before the first activation.
+    """
+    # The number of distinct states depends on the data, which
+    # torch.func.vmap (--fused_learner) does not support
+    fusable = False
+
+    def __init__(self, planes=(72, 144, 288), hidden=(2048, 512, 128), blocks=3, se=True):
+        super().__init__(planes, hidden, blocks, se)
+        self.in_planes = 71
+        self.layer1 = self._make_layer(BasicBlockM, planes[0], blocks, stride=2)
+        self.action_linear1 = nn.Linear(54, 256)
+        self.action_linear2 = nn.Linear(256, hidden[0])
+
+    def values(self, z, x):
+        # Rows with the same state as the row before belong to the same
+        # decision (also for decisions batched by the actor threads)
+        first, index = distinct_runs(torch.cat([z[:, 1:].flatten(1), x], dim=-1))
+        out = self.layer1(z[first, 1:])
+        out = self.layer2(out)
+        out = self.layer3(out)
+        out = out.flatten(1, 2)
+        xs = x[first]
+        out = self.linear1(torch.cat([xs, xs, xs, xs, out], dim=-1))
+        action = F.leaky_relu(self.action_linear1(z[:, 0]))
+        out = F.leaky_relu_(out[index] + self.action_linear2(action))
+        out = F.leaky_relu_(self.linear2(out))
+        out = F.leaky_relu_(self.linear3(out))
+        # Back to float32 when running under bfloat16 autocast (--bf16)
+        out = self.linear4(out).float()
+        win_rate, win, lose = torch.split(out, (1, 1, 1), dim=-1)
+        win_rate = torch.tanh(win_rate)
+        return win_rate, win, lose
+
+
+# Sizes of the play networks (resnet or split) from the full network
+# down, for --play_preset and the students of distill.py. Parameters,
+# FLOPs and latency are reported by `python benchmark.py --mode profile`.
+STUDENT_PRESETS = {
+    'full': dict(planes=[72, 144, 288], hidden=[2048, 512, 128]),
+    'medium': dict(planes=[48, 96, 192], hidden=[1024, 256, 128]),
+    'small': dict(planes=[32, 64, 128], hidden=[512, 256, 64]),
+    'tiny': dict(planes=[16, 32, 64], hidden=[256, 128, 64]),
+}
+
+
+def split_from_resnet(resnet):
+    """
+    A GeneralModelSplit initialised from a trained GeneralModelResnet.
+    The weights on the action row of the first convolutions are dropped
+    and the action MLP starts at zero, so the result still needs to be
+    distilled from `resnet` (see distill.py).
+    """
+    state_dict = resnet.state_dict()
+    arch = infer_arch(state_dict)
+    arch['type'] = 'split'
+    split = create_model(arch)
+    for k in ['layer1.0.conv1.weight', 'layer1.0.shortcut.0.weight']:
+        if k in state_dict:
+            state_dict[k] = state_dict[k][:, 1:]
+    split_state_dict = split.state_dict()
+    split_state_dict.update({k: v for k, v in state_dict.items()
+                             if k in split_state_dict and v.shape == split_state_dict[k].shape})
+    split.load_state_dict(split_state_dict)
+    nn.init.zeros_(split.action_linear2.weight)
+    nn.init.zeros_(split.action_linear2.bias)
+    return split
 
 
 class GeneralModelBid(nn.Module):
-    def __init__(self):
+    def __init__(self, planes=(5, 10, 20), hidden=(256, 256, 128), blocks=3, se=True):
         super().__init__()
         self.in_planes = 5
+        self.se = se
         # input 1*54*22
-        self.layer1 = self._make_layer(BasicBlockM, 5, 3, stride=2)  # 1*14*12
-        self.layer2 = self._make_layer(BasicBlockM, 10, 3, stride=2)  # 1*7*24
-        self.layer3 = self._make_layer(BasicBlockM, 20, 3, stride=2)  # 1*4*48
-        self.linear1 = nn.Linear(20 * BasicBlockM.expansion * 7, 256)
-        self.linear2 = nn.Linear(256, 256)
-        self.linear3 = nn.Linear(256, 128)
-        self.linear4 = nn.Linear(128, 5)
+        self.layer1 = self._make_layer(BasicBlockM, planes[0], blocks, stride=2)  # 1*14*12
+        self.layer2 = self._make_layer(BasicBlockM, planes[1], blocks, stride=2)  # 1*7*24
+        self.layer3 = self._make_layer(BasicBlockM, planes[2], blocks, stride=2)  # 1*4*48
+        self.linear1 = nn.Linear(planes[2] * BasicBlockM.expansion * 7, hidden[0])
+        self.linear2 = nn.Linear(hidden[0], hidden[1])
+        self.linear3 = nn.Linear(hidden[1], hidden[2])
+        self.linear4 = nn.Linear(hidden[2], 5)
 
     def _make_layer(self, block, planes, num_blocks, stride):
         strides = [stride] + [1] * (num_blocks - 1)
         layers = []
         for stride in strides:
-            layers.append(block(self.in_planes, planes, stride))
+            layers.append(block(self.in_planes, planes, stride, self.se))
             self.in_planes = planes * block.expansion
         return nn.Sequential(*layers)
 
-    def forward(self, z, x, return_value=False, flags=None):
+    def values(self, z, x):
         out = self.layer1(z)
         out = self.layer2(out)
         out = self.layer3(out)
@@ -154,19 +266,27 @@ class GeneralModelBid(nn.Module):
         out = F.leaky_relu_(self.linear1(out))
         out = F.leaky_relu_(self.linear2(out))
         out = F.leaky_relu_(self.linear3(out))
-        out = self.linear4(out)
+        # Back to float32 when running under bfloat16 autocast (--bf16)
+        out = self.linear4(out).float()
         win_rate, win, lose = torch.split(out, (3, 1, 1), dim=-1)
         win_rate = torch.softmax(win_rate, dim=-1)
+        return win_rate, win, lose
+
+    @torch.jit.unused
+    def select_action(self, win_rate, win, lose, z, flags=None):
         out = win_rate[:, :1] * win + win_rate[:, 1:2] * lose
+        if flags is not None and flags.exp_epsilon > 0 and np.random.rand() < flags.exp_epsilon:
+            action = torch.randint(out.shape[0], (1,))[0]
+        else:
+            action = torch.argmax(out, dim=0)[0]
+        return dict(action=action, max_value=torch.max(out), values=out)
 
+    @torch.jit.unused
+    def forward(self, z, x, return_value=False, flags=None):
+        win_rate, win, lose = self.values(z, x)
         if return_value:
             return dict(values=(win_rate, win, lose))
-        else:
-            if flags is not None and flags.exp_epsilon > 0 and np.random.rand() < flags.exp_epsilon:
-                action = torch.randint(out.shape[0], (1,))[0]
-            else:
-                action = torch.argmax(out, dim=0)[0]
-            return dict(action=action, max_value=torch.max(out), values=out)
+        return self.select_action(win_rate, win, lose, z, flags)
 
 
 class PositionalEncoding(nn.Module):
@@ -185,44 +305,60 @@ class PositionalEncoding(nn.Module):
 
 
 class GeneralModelTransformer(nn.Module):
-    def __init__(self, d_model=256, nhead=8, num_encoder_layers=6):
+    def __init__(self, d_model=256, nhead=8, num_encoder_layers=6, dim_feedforward=758,
+                 planes=(12, 24, 48), hidden=(1024, 512, 128), blocks=3, se=True):
         super(GeneralModelTransformer, self).__init__()
 
         self.in_planes = 12
+        self.se = se
 
-        self.layer1 = self._make_layer(BasicBlockM, 12, 3, stride=2)
-        self.layer2 = self._make_layer(BasicBlockM, 24, 3, stride=2)
-        self.layer3 = self._make_layer(BasicBlockM, 48, 3, stride=2)
+        self.layer1 = self._make_layer(BasicBlockM, planes[0], blocks, stride=2)
+        self.layer2 = self._make_layer(BasicBlockM, planes[1], blocks, stride=2)
+        self.layer3 = self._make_layer(BasicBlockM, planes[2], blocks, stride=2)
 
         self.fc1 = nn.Linear(54, d_model)
         self.pos_encoder = PositionalEncoding(d_model, max_len=60)
         self.encoder_layer = nn.TransformerEncoderLayer(d_model=d_model, nhead=nhead,
-                                                        dim_feedforward=758, batch_first=True)
+                                                        dim_feedforward=dim_feedforward, batch_first=True)
         self.transformer_encoder = nn.TransformerEncoder(self.encoder_layer, num_layers=num_encoder_layers)
         self.conv = nn.Conv1d(60, 4, kernel_size=3, stride=1, padding=1, bias=False)
         self.bn1 = nn.BatchNorm1d(4)
 
-        self.linear1 = nn.Linear(d_model * 4 + 18 * 2 + 48 * BasicBlockM.expansion * 7, 1024)
-        self.linear2 = nn.Linear(1024, 512)
-        self.linear3 = nn.Linear(512, 128)
-        self.linear4 = nn.Linear(128, 3)
+        self.linear1 = nn.Linear(d_model * 4 + 18 * 2 + planes[2] * BasicBlockM.expansion * 7, hidden[0])
+        self.linear2 = nn.Linear(hidden[0], hidden[1])
+        self.linear3 = nn.Linear(hidden[1], hidden[2])
+        self.linear4 = nn.Linear(hidden[2], 3)
 
         self.mish = nn.Mish(inplace=True)
+        # In eval mode encode the history once per decision, see `values`
+        self.share_history = True
 
     def _make_layer(self, block, planes, num_blocks, stride):
         strides = [stride] + [1] * (num_blocks - 1)
         layers = []
         for stride in strides:
-            layers.append(block(self.in_planes, planes, stride))
+            layers.append(block(self.in_planes, planes, stride, self.se))
             self.in_planes = planes * block.expansion
         return nn.Sequential(*layers)
 
-    def forward(self, src1, src2, return_value=False, flags=None):
-        out1 = self.fc1(src1[:, -60:])
-        out1 = self.pos_encoder(out1)
-        out1 = self.transformer_encoder(out1)
-        out1 = self.mish(self.bn1(self.conv(out1)))
-        out1 = out1.flatten(1, 2)
+    def encode_history(self, history):
+        out = self.fc1(history)
+        out = self.pos_encoder(out)
+        out = self.transformer_encoder(out)
+        out = self.mish(self.bn1(self.conv(out)))
+        return out.flatten(1, 2)
+
+    def values(self, src1, src2):
+        history = src1[:, -60:]
+        if self.share_history and not self.training:
+            # The last 60 rows (the move history) are the same for all
+            # legal actions of a decision. The encoder attends in both
+            # directions and the newest move comes first, so every row
+            # changes with each move and nothing is reused across turns.
+            first, index = distinct_runs(history)
+            out1 = self.encode_history(history[first])[index]
+        else:
+            out1 = self.encode_history(history)
 
         out = self.layer1(src1[:, :-60])
         out = self.layer2(out)
@@ -233,21 +369,29 @@ class GeneralModelTransformer(nn.Module):
         out = F.leaky_relu_(self.linear1(out))
         out = F.leaky_relu_(self.linear2(out))
         out = F.leaky_relu_(self.linear3(out))
-        out = self.linear4(out)
+        # Back to float32 when running under bfloat16 autocast (--bf16)
+        out = self.linear4(out).float()
 
         win_rate, win, lose = torch.split(out, (1, 1, 1), dim=-1)
         win_rate = torch.tanh(win_rate)
+        return win_rate, win, lose
+
+    @torch.jit.unused
+    def select_action(self, win_rate, win, lose, z, flags=None):
         _win_rate = (win_rate + 1) / 2
         out = _win_rate * win + (1. - _win_rate) * lose
+        if flags is not None and flags.exp_epsilon > 0 and np.random.rand() < flags.exp_epsilon:
+            action = torch.randint(out.shape[0], (1,))[0]
+        else:
+            action = torch.argmax(out, dim=0)[0]
+        return dict(action=action, max_value=torch.max(out), values=out)
 
+    @torch.jit.unused
+    def forward(self, src1, src2, return_value=False, flags=None):
+        win_rate, win, lose = self.values(src1, src2)
         if return_value:
             return dict(values=(win_rate, win, lose))
-        else:
-            if flags is not None and flags.exp_epsilon > 0 and np.random.rand() < flags.exp_epsilon:
-                action = torch.randint(out.shape[0], (1,))[0]
-            else:
-                action = torch.argmax(out, dim=0)[0]
-            return dict(action=action, max_value=torch.max(out), values=out)
+        return self.select_action(win_rate, win, lose, src1, flags)
 
 
 GeneralModel = GeneralModelTransformer
@@ -263,23 +407,106 @@ model_dict = {
 }
 
 
+# Network types of an architecture (see `create_model`)
+MODEL_TYPES = {
+    'bid': GeneralModelBid,
+    'resnet': GeneralModelResnet,
+    'split': GeneralModelSplit,
+    'transformer': GeneralModelTransformer,
+}
+
+# Architectures of the bid and the play positions
+DEFAULT_ARCH = {
+    'bid': {'type': 'bid'},
+    'play': {'type': 'resnet'},
+}
+
+
+def position_group(position):
+    return 'bid' if position in ['first', 'second', 'third'] else 'play'
+
+
+def create_model(arch):
+    """
+    Build the network of an architecture: a dict of its `type` (see
+    MODEL_TYPES) and constructor arguments, e.g. {'type': 'resnet',
+    'planes': [32, 64, 128], 'hidden': [512, 256, 64], 'blocks': 2,
+    'se': False}.
+    """
+    arch = dict(arch)
+    return MODEL_TYPES[arch.pop('type')](**arch)
+
+
+def infer_arch(state_dict):
+    """
+    The architecture of a state dict, for checkpoints saved without it.
+    The number of attention heads of a transformer can not be told from
+    its weights and is left at the default.
+    """
+    def count(prefix):
+        return len({k[len(prefix):].split('.')[0] for k in state_dict if k.startswith(prefix)})
+
+    if 'action_linear1.weight' in state_dict:
+        arch = dict(type='split')
+    elif 'fc1.weight' in state_dict:
+        arch = dict(type='transformer', d_model=state_dict['fc1.weight'].shape[0],
+                    num_encoder_layers=count('transformer_encoder.layers.'),
+                    dim_feedforward=state_dict['transformer_encoder.layers.0.linear1.weight'].shape[0])
+    elif state_dict['linear4.weight'].shape[0] == 5:
+        arch = dict(type='bid')
+    else:
+        arch = dict(type='resnet')
+    arch.update(planes=[state_dict['layer%d.0.conv1.weight' % n].shape[0] for n in (1, 2, 3)],
+                hidden=[state_dict['linear%d.weight' % n].shape[0] for n in (1, 2, 3)],
+                blocks=count('layer1.'), se=any(k.startswith('layer1.0.se.') for k in state_dict))
+    return arch
+
+
+def model_arch(flags):
+    """
+    The architecture of every position group from --play_model,
+    --play_preset and --model_config (a JSON file or string such as
+    '{"play": {"blocks": 2, "se": false}}' that overrides the others).
+    """
+    arch = copy.deepcopy(DEFAULT_ARCH)
+    arch['play']['type'] = flags.play_model
+    if flags.play_preset:
+        if flags.play_model not in ['resnet', 'split']:
+            raise ValueError('--play_preset only applies to the resnet and split play models')
+        arch['play'].update(copy.deepcopy(STUDENT_PRESETS[flags.play_preset]))
+    if flags.model_config:
+        if os.path.exists(flags.model_config):
+            with open(flags.model_config) as f:
+                config = json.load(f)
+        else:
+            config = json.loads(flags.model_config)
+        for group, group_arch in config.items():
+            arch[group].update(group_arch)
+    return arch
+
+
 class Model:
     """
     The wrapper for the three models. We also wrap several
     interfaces such as share_memory, eval, etc.
     """
-    def __init__(self, device=0):
+    def __init__(self, device=0, arch=None):
         if not device == "cpu":
             device = 'cuda:' + str(device)
 
+        self.arch = arch if arch is not None else DEFAULT_ARCH
         self.models = {
-            'first': GeneralModelBid().to(torch.device(device)),
-            'second': GeneralModelBid().to(torch.device(device)),
-            'third': GeneralModelBid().to(torch.device(device)),
-            'landlord': GeneralModelResnet().to(torch.device(device)),
-            'landlord_down': GeneralModelResnet().to(torch.device(device)),
-            'landlord_up': GeneralModelResnet().to(torch.device(device)),
+            'first': create_model(self.arch['bid']).to(torch.device(device)),
+            'second': create_model(self.arch['bid']).to(torch.device(device)),
+            'third': create_model(self.arch['bid']).to(torch.device(device)),
+            'landlord': create_model(self.arch['play']).to(torch.device(device)),
+            'landlord_down': create_model(self.arch['play']).to(torch.device(device)),
+            'landlord_up': create_model(self.arch['play']).to(torch.device(device)),
         }
+        # Number of updates the learner has published for every position.
+        # Actors tag their samples with it to measure the policy lag.
+        self.versions = torch.zeros(len(self.models), dtype=torch.int64)
+        self.version_index = {p: n for n, p in enumerate(self.models)}
 
     def forward(self, position, z, x, training=False, flags=None, debug=False):
         model = self.models[position]
@@ -292,6 +519,7 @@ class Model:
         self.models['landlord'].share_memory()
         self.models['landlord_down'].share_memory()
         self.models['landlord_up'].share_memory()
+        self.versions.share_memory_()
 
     def eval(self):
         self.models['first'].eval()
@@ -310,6 +538,12 @@ class Model:
     def get_models(self):
         return self.models
 
+    def get_version(self, position):
+        return int(self.versions[self.version_index[position]])
+
+    def bump_version(self, position):
+        self.versions[self.version_index[position]] += 1
+
 
 class LandlordLstmModel(nn.Module):
     def __init__(self):
@@ -322,10 +556,12 @@ class LandlordLstmModel(nn.Module):
         self.dense5 = nn.Linear(512, 512)
         self.dense6 = nn.Linear(512, 1)
 
-    def forward(self, z, x, return_value=False, flags=None):
+    def encode_history(self, z):
         lstm_out, (h_n, _) = self.lstm(z)
-        lstm_out = lstm_out[:, -1, :]
-        x = torch.cat([lstm_out, x], dim=-1)
+        return lstm_out[:, -1, :]
+
+    def head(self, history, x):
+        x = torch.cat([history, x], dim=-1)
         x = self.dense1(x)
         x = torch.relu(x)
         x = self.dense2(x)
@@ -336,7 +572,10 @@ class LandlordLstmModel(nn.Module):
         x = torch.relu(x)
         x = self.dense5(x)
         x = torch.relu(x)
-        x = self.dense6(x)
+        return self.dense6(x)
+
+    def forward(self, z, x, return_value=False, flags=None):
+        x = self.head(self.encode_history(z), x)
         if return_value:
             return dict(values=x)
         else:
@@ -358,10 +597,12 @@ class FarmerLstmModel(nn.Module):
         self.dense5 = nn.Linear(512, 512)
         self.dense6 = nn.Linear(512, 1)
 
-    def forward(self, z, x, return_value=False, flags=None):
+    def encode_history(self, z):
         lstm_out, (h_n, _) = self.lstm(z)
-        lstm_out = lstm_out[:, -1, :]
-        x = torch.cat([lstm_out, x], dim=-1)
+        return lstm_out[:, -1, :]
+
+    def head(self, history, x):
+        x = torch.cat([history, x], dim=-1)
         x = self.dense1(x)
         x = torch.relu(x)
         x = self.dense2(x)
@@ -372,7 +613,10 @@ class FarmerLstmModel(nn.Module):
         x = torch.relu(x)
         x = self.dense5(x)
         x = torch.relu(x)
-        x = self.dense6(x)
+        return self.dense6(x)
+
+    def forward(self, z, x, return_value=False, flags=None):
+        x = self.head(self.encode_history(z), x)
         if return_value:
             return dict(values=x)
         else:
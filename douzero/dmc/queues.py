@@ -0,0 +1,101 @@
+"""
+Bounded queues used to pass rollouts from the actor processes
+to the learner threads. Each queue keeps a few shared counters
+(depth, drops and time spent waiting on both ends) so that the
+main process can report them without touching the queue itself.
+"""
+import queue
+import timeit
+
+QUEUE_POLICIES = ['block', 'drop_oldest', 'drop_newest']
+
+
+class BatchQueue:
+    """
+    A multiprocessing queue with a maximum size and a policy that
+    decides what happens when an actor tries to put into a full
+    queue:
+
+    `block`: the actor waits until the learner frees a slot
+    `drop_oldest`: the oldest rollout is discarded to make room
+    `drop_newest`: the new rollout is discarded
+    """
+    def __init__(self, ctx, maxsize=0, policy='block'):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError('Unknown queue policy: %s' % policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.queue = ctx.Queue(maxsize=maxsize)
+        self._depth = ctx.Value('l', 0)
+        self._puts = ctx.Value('l', 0)
+        self._drops = ctx.Value('l', 0)
+        self._put_wait = ctx.Value('d', 0.)
+        self._get_wait = ctx.Value('d', 0.)
+
+    @staticmethod
+    def _add(value, amount):
+        with value.get_lock():
+            value.value += amount
+
+    def put(self, item):
+        """
+        Put a rollout into the queue. Returns False if the rollout
+        was dropped because of the `drop_newest` policy.
+        """
+        start = timeit.default_timer()
+        accepted = True
+        if self.policy == 'block' or self.maxsize <= 0:
+            self.queue.put(item)
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    pass
+                if self.policy == 'drop_newest':
+                    accepted = False
+                    break
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    continue
+                self._add(self._depth, -1)
+                self._add(self._drops, 1)
+        if accepted:
+            self._add(self._depth, 1)
+            self._add(self._puts, 1)
+        else:
+            self._add(self._drops, 1)
+        self._add(self._put_wait, timeit.default_timer() - start)
+        return accepted
+
+    def get(self):
+        start = timeit.default_timer()
+        item = self.queue.get()
+        self._add(self._get_wait, timeit.default_timer() - start)
+        self._add(self._depth, -1)
+        return item
+
+    def stats(self):
+        return dict(
+            depth=max(self._depth.value, 0),
+            puts=self._puts.value,
+            drops=self._drops.value,
+            put_wait=self._put_wait.value,
+            get_wait=self._get_wait.value,
+        )
+
+
+def queue_stats(batch_queues, positions):
+    """
+    Sum the counters of the queues of every device for each position.
+    """
+    stats = {}
+    for position in positions:
+        total = dict(depth=0, puts=0, drops=0, put_wait=0., get_wait=0.)
+        for device in batch_queues:
+            for k, v in batch_queues[device][position].stats().items():
+                total[k] += v
+        stats[position] = total
+    return stats
@@ -0,0 +1,90 @@
+"""
+Optional replay store for the learners (--replay_capacity). Without it
+every sample is trained on exactly once. With it the learner of a
+position keeps the most recent (`fifo`) or a uniform random subset
+(`reservoir`) of the samples it has received, and trains on random
+samples from the store. --replay_ratio sets how many learner batches
+are drawn for every fresh batch, trading data freshness for learner
+utilisation when the actors can not keep up. The `policy_lag_*` stats
+show how stale the trained samples are.
+"""
+import threading
+
+import torch
+
+REPLAY_POLICIES = ['fifo', 'reservoir']
+
+
+class ReplayBuffer:
+    """
+    Stores up to `capacity` samples (rows of a flattened batch) of one
+    position. The storage is allocated on the first `add`, from the
+    shapes of the incoming batch.
+    """
+    def __init__(self, capacity, policy='fifo'):
+        if policy not in REPLAY_POLICIES:
+            raise ValueError('Unknown replay policy: %s' % policy)
+        self.capacity = capacity
+        self.policy = policy
+        self.storage = None
+        self.size = 0
+        self.seen = 0
+        self._next = 0
+
+    def add(self, batch):
+        if batch['done'].dim() > 1:
+            batch = {k: torch.flatten(v, 0, 1) for k, v in batch.items()}
+        n = batch['done'].shape[0]
+        if self.storage is None:
+            self.storage = {k: torch.empty((self.capacity,) + v.shape[1:], dtype=v.dtype)
+                            for k, v in batch.items()}
+        if self.policy == 'fifo':
+            if n > self.capacity:
+                batch = {k: v[-self.capacity:] for k, v in batch.items()}
+                n = self.capacity
+            rows = torch.arange(n)
+            index = (self._next + rows) % self.capacity
+            self._next = (self._next + n) % self.capacity
+        else:
+            # Algorithm R: the k-th sample ever seen replaces a random
+            # slot with probability capacity / (k + 1)
+            seen = self.seen + torch.arange(n)
+            index = torch.where(seen < self.capacity, seen,
+                                (torch.rand(n) * (seen + 1).double()).long())
+            rows = (index < self.capacity).nonzero().flatten()
+            index = index[rows]
+        for k, v in self.storage.items():
+            v[index] = batch[k][rows]
+        self.seen += n
+        self.size = min(self.seen, self.capacity)
+
+    def sample(self, n):
+        index = torch.randint(self.size, (n,))
+        return {k: v[index] for k, v in self.storage.items()}
+
+
+class ReplaySource:
+    """
+    Wraps a batch source (see `create_batch_source`). Every fresh batch
+    is added to the store and `ratio` batches of the same size are
+    sampled from it per fresh batch on average.
+    """
+    def __init__(self, next_batch, replay, ratio):
+        if ratio <= 0:
+            raise ValueError('The replay ratio must be positive')
+        self.next_batch = next_batch
+        self.replay = replay
+        self.ratio = ratio
+        self._credit = 0.
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            while self._credit < 1:
+                batch = self.next_batch()
+                self._rows = batch['done'].numel()
+                self.replay.add(batch)
+                self._credit += self.ratio
+            self._credit -= 1
+            return self.replay.sample(self._rows)
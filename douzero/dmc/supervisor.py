@@ -0,0 +1,106 @@
+"""
+Keeps the actor processes alive during long runs. The main training
+loop calls `check` periodically; actors that exited are started again
+with a fresh seed. Since the actors read the shared-memory models,
+a restarted actor plays with the current weights straight away.
+"""
+import json
+import os
+import time
+
+from .utils import log, actor_crash_path
+
+
+def _fresh_seed():
+    return int.from_bytes(os.urandom(4), 'little')
+
+
+class ActorSupervisor:
+    def __init__(self, ctx, target, flags):
+        self.ctx = ctx
+        self.target = target
+        self.flags = flags
+        self.max_restarts = flags.max_actor_restarts
+        self.basepath = os.path.expandvars(os.path.expanduser(
+            '%s/%s' % (flags.savedir, flags.xpid)))
+        self.report_path = os.path.join(self.basepath, 'actors.json')
+        self.actors = {}
+
+    def start(self, device, i, args):
+        """
+        Start actor `i` of `device`. `args` are passed to the target
+        followed by a new seed.
+        """
+        key = '%s_%d' % (device, i)
+        info = self.actors.setdefault(key, dict(
+            device=device, index=i, args=args, process=None,
+            crashes=0, restarts=0, last_exitcode=None,
+            last_crash_time=None, last_traceback=None, seed=None))
+        info['seed'] = _fresh_seed()
+        process = self.ctx.Process(target=self.target, args=args + (info['seed'],))
+        process.start()
+        info['process'] = process
+        return process
+
+    def check(self):
+        """
+        Restart every actor that has died. Returns the number of
+        actors restarted by this call.
+        """
+        restarted = 0
+        crashed = 0
+        for key, info in self.actors.items():
+            process = info['process']
+            if process is None or process.is_alive():
+                continue
+            process.join()
+            info['process'] = None
+            info['last_exitcode'] = process.exitcode
+            if process.exitcode != 0:
+                crashed += 1
+                info['crashes'] += 1
+                info['last_crash_time'] = time.time()
+                # The traceback file is removed once read, so that it is
+                # not reported again for a later death without one
+                crash_path = actor_crash_path(self.flags, info['device'], info['index'])
+                info['last_traceback'] = None
+                if os.path.exists(crash_path):
+                    with open(crash_path) as f:
+                        info['last_traceback'] = f.read()
+                    os.remove(crash_path)
+            if 0 <= self.max_restarts <= info['restarts']:
+                log.error('Actor %s died (exit code %s) and reached the restart limit, not restarting',
+                          key, process.exitcode)
+                continue
+            log.warning('Actor %s died (exit code %s), restarting it', key, process.exitcode)
+            info['restarts'] += 1
+            self.start(info['device'], info['index'], info['args'])
+            restarted += 1
+        if crashed or restarted:
+            self._write_report()
+        return restarted
+
+    def num_alive(self):
+        return sum(1 for info in self.actors.values()
+                   if info['process'] is not None and info['process'].is_alive())
+
+    def crashes(self):
+        return sum(info['crashes'] for info in self.actors.values())
+
+    def stop(self):
+        for info in self.actors.values():
+            if info['process'] is not None and info['process'].is_alive():
+                info['process'].terminate()
+        for info in self.actors.values():
+            if info['process'] is not None:
+                info['process'].join()
+
+    def _write_report(self):
+        report = {key: {k: info[k] for k in ['device', 'index', 'crashes', 'restarts', 'last_exitcode',
+                                              'last_crash_time', 'last_traceback', 'seed']}
+                  for key, info in self.actors.items()}
+        os.makedirs(self.basepath, exist_ok=True)
+        tmp_path = self.report_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(report, f, indent=4, default=str)
+        os.replace(tmp_path, self.report_path)
@@ -0,0 +1,150 @@
+"""
+Opt-in timeline tracer (--trace_dir) in the Chrome trace event format,
+viewable in chrome://tracing or https://ui.perfetto.dev. Every process
+appends its spans to <trace_dir>/trace_<pid>.json, and the training
+process merges the files into <trace_dir>/trace.json at shutdown.
+
+Spans are only recorded between --trace_start and --trace_start +
+--trace_duration seconds after a process configured its tracer, and
+only for the --trace_sample share of the steps (actor decisions,
+learner steps) of every thread, so it can stay on in production for
+short windows. Without a tracer `record` and `span` return at once.
+
+The timestamps are perf_counter values, which share the monotonic
+clock across the processes of a machine.
+"""
+import atexit
+import contextlib
+import glob
+import json
+import os
+import random
+import threading
+import timeit
+
+_tracer = None
+_NULL_SPAN = contextlib.nullcontext()
+FLUSH_SECS = 2.
+
+
+class Tracer:
+    def __init__(self, path, process_name, sample=1., start=0., duration=60.):
+        self.path = path
+        self.pid = os.getpid()
+        self.sample = sample
+        now = timeit.default_timer()
+        self.begin = now + start
+        self.end = self.begin + duration if duration > 0 else float('inf')
+        self.done = False
+        self._events = [dict(name='process_name', ph='M', pid=self.pid, tid=0, args=dict(name=process_name))]
+        self._threads = set()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_flush = now
+        with open(self.path, 'w') as f:
+            f.write('[\n')
+        atexit.register(self.flush)
+
+    def begin_step(self):
+        self._local.sampled = self.sample >= 1 or random.random() < self.sample
+
+    def add(self, name, start, end, args):
+        if self.done or start < self.begin or not getattr(self._local, 'sampled', True):
+            return
+        if start >= self.end:
+            self.flush()
+            self.done = True
+            return
+        tid = threading.get_native_id()
+        with self._lock:
+            if tid not in self._threads:
+                self._threads.add(tid)
+                self._events.append(dict(name='thread_name', ph='M', pid=self.pid, tid=tid,
+                                         args=dict(name=threading.current_thread().name)))
+            self._events.append(dict(name=name, ph='X', ts=start * 1e6, dur=(end - start) * 1e6,
+                                     pid=self.pid, tid=tid, args=args))
+        if end - self._last_flush > FLUSH_SECS:
+            self.flush()
+
+    def flush(self):
+        """Append the recorded spans to the trace file."""
+        with self._lock:
+            self._last_flush = timeit.default_timer()
+            events, self._events = self._events, []
+            if events:
+                with open(self.path, 'a') as f:
+                    # The closing bracket of the JSON array is optional
+                    # in the trace event format
+                    f.write(''.join(json.dumps(e) + ',\n' for e in events))
+
+
+def configure(flags, process_name):
+    """Set up the tracer of this process from the flags, once per process."""
+    global _tracer
+    if not flags.trace_dir or (_tracer is not None and _tracer.pid == os.getpid()):
+        return _tracer
+    os.makedirs(flags.trace_dir, exist_ok=True)
+    _tracer = Tracer(os.path.join(flags.trace_dir, 'trace_%d.json' % os.getpid()), process_name,
+                     flags.trace_sample, flags.trace_start, flags.trace_duration)
+    return _tracer
+
+
+def begin_step():
+    """Decide whether the spans of the next step of this thread are sampled."""
+    if _tracer is not None:
+        _tracer.begin_step()
+
+
+def record(name, start, end, **args):
+    """Record a span between two timeit.default_timer() values."""
+    if _tracer is not None:
+        _tracer.add(name, start, end, args)
+
+
+class _Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+
+    def __exit__(self, *exc):
+        _tracer.add(self.name, self.start, timeit.default_timer(), self.args)
+
+
+def span(name, **args):
+    """Context manager that records the span of its block."""
+    if _tracer is None:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def close():
+    if _tracer is not None:
+        _tracer.flush()
+
+
+def read_trace(path):
+    with open(path) as f:
+        text = f.read().rstrip().rstrip(',')
+    if not text.endswith(']'):
+        text += ']'
+    return json.loads(text)
+
+
+def merge_traces(trace_dir):
+    """Merge the per-process trace files into <trace_dir>/trace.json. Returns its path."""
+    events = []
+    for path in sorted(glob.glob(os.path.join(trace_dir, 'trace_*.json'))):
+        try:
+            events += read_trace(path)
+        except ValueError:
+            # A process killed while appending leaves a partial last line
+            with open(path) as f:
+                lines = f.read().splitlines()[1:]
+            events += [json.loads(line.rstrip(',')) for line in lines[:-1]]
+    output = os.path.join(trace_dir, 'trace.json')
+    with open(output, 'w') as f:
+        json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+    return output
@@ -1,10 +1,21 @@
+import contextlib
+import os
+import queue
+import random
+import threading
 import typing
 import logging
+import timeit
 import traceback
 import numpy as np
 from collections import Counter
 import torch
 from .env_utils import Environment
+from .actor_stats import ActorStats
+from .replay import ReplayBuffer, ReplaySource
+from .models import Model
+from .inference import InferenceModel
+from . import tracing
 from douzero.env import Env
 
 Card2Column = {3: 0, 4: 1, 5: 2, 6: 3, 7: 4, 8: 5, 9: 6, 10: 7,
@@ -35,36 +46,211 @@ def create_env(flags):
     return Env(flags)
 
 
-def get_batch(b_queues, position, flags, lock):
+def autocast(flags, device):
+    """
+    bfloat16 autocast for the forward passes when --bf16 is set. The
+    parameters, the loss and the optimizer state stay in float32.
+    """
+    if flags is None or not flags.bf16:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type='cpu' if str(device) == 'cpu' else 'cuda', dtype=torch.bfloat16)
+
+
+def parse_position_values(default, overrides):
+    """
+    Expand a `position=value,...` string into a dict holding a value
+    for every position. Positions that are not listed use `default`.
+    """
+    positions = ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']
+    values = {p: default for p in positions}
+    if not overrides:
+        return values
+    for item in overrides.split(','):
+        key, value = item.split('=')
+        key = key.strip()
+        if key == 'bid':
+            keys = ['first', 'second', 'third']
+        elif key == 'play':
+            keys = ['landlord', 'landlord_up', 'landlord_down']
+        elif key in positions:
+            keys = [key]
+        else:
+            raise ValueError('Unknown position in %r: %s' % (overrides, key))
+        for k in keys:
+            values[k] = int(value)
+    return values
+
+
+def get_unroll_lengths(flags):
+    return parse_position_values(flags.unroll_length, flags.position_unroll_length)
+
+
+def get_batch_sizes(flags):
+    return parse_position_values(flags.batch_size, flags.position_batch_size)
+
+
+class AdaptiveBatchScheduler:
+    """
+    Sizes the learner batch of every position from the rate at which
+    its rollouts arrive, so that positions which produce few samples
+    (the bidding positions) are updated about as often as the busy
+    ones instead of waiting for a full batch.
+    """
+    def __init__(self, batch_sizes, target_interval=0., smoothing=0.5):
+        self.batch_sizes = batch_sizes
+        self.max_batch_sizes = dict(batch_sizes)
+        self.target_interval = target_interval
+        self.smoothing = smoothing
+        self.rates = {}
+
+    def update(self, rollouts, elapsed):
+        """
+        `rollouts` maps each position to the number of rollouts that
+        arrived during the last `elapsed` seconds.
+        """
+        for p, n in rollouts.items():
+            rate = n / max(elapsed, 1e-6)
+            if p in self.rates:
+                rate = self.smoothing * self.rates[p] + (1 - self.smoothing) * rate
+            self.rates[p] = rate
+        interval = self.target_interval
+        if interval <= 0:
+            # Follow the busiest position at its configured batch size
+            intervals = [self.max_batch_sizes[p] / r for p, r in self.rates.items() if r > 0]
+            if not intervals:
+                return self.batch_sizes
+            interval = min(intervals)
+        for p, rate in self.rates.items():
+            b = int(round(rate * interval))
+            self.batch_sizes[p] = min(max(b, 1), self.max_batch_sizes[p])
+        return self.batch_sizes
+
+
+def get_batch(b_queues, position, flags, lock, batch_size=None):
     b_queue = b_queues
+    if batch_size is None:
+        batch_size = flags.batch_size
     buffer = []
-    while len(buffer) < flags.batch_size:
+    start = timeit.default_timer()
+    while len(buffer) < batch_size:
+        get_start = timeit.default_timer()
         buffer.append(b_queue.get())
+        tracing.record('queue_get', get_start, timeit.default_timer(), position=position)
     batch = {
         key: torch.stack([m[key] for m in buffer], dim=1)
         for key in ["done", "episode_return", "target_adp", "target_wp",
-                    "target_wp_bid", "obs_z", "obs_x_batch"]
+                    "target_wp_bid", "obs_z", "obs_x_batch", "version"]
     }
     del buffer
+    tracing.record('get_batch', start, timeit.default_timer(), position=position, batch_size=batch_size)
     return batch
 
 
+def flatten_batch(batch):
+    """
+    Merge the time and batch dimensions, (T, B, ...) -> (T*B, ...).
+    """
+    return {key: torch.flatten(value, 0, 1) for key, value in batch.items()}
+
+
+class BatchPrefetcher:
+    """
+    Assembles the next batches of one position in a background thread
+    while the learner runs the current step. The batches are already
+    flattened and, with `pin_memory`, copied to page-locked memory so
+    that the transfer to the training GPU can run asynchronously.
+    `batch_size` is a callable so that resized batches are picked up.
+    """
+    def __init__(self, b_queue, position, flags, lock, batch_size, depth=1, pin_memory=False):
+        self.b_queue = b_queue
+        self.position = position
+        self.flags = flags
+        self.lock = lock
+        self.batch_size = batch_size
+        self.pin_memory = pin_memory
+        self.batches = queue.Queue(maxsize=depth)
+        self.error = None
+        self._thread = threading.Thread(target=self._loop, name='prefetch-%s' % position, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        try:
+            while True:
+                tracing.begin_step()
+                batch = flatten_batch(get_batch(self.b_queue, self.position, self.flags, self.lock,
+                                                batch_size=self.batch_size()))
+                if self.pin_memory:
+                    batch = {key: value.pin_memory() for key, value in batch.items()}
+                self.batches.put(batch)
+        except Exception as e:
+            self.error = e
+            self.batches.put(e)
+
+    def get(self):
+        if self.error is not None:
+            raise self.error
+        batch = self.batches.get()
+        if isinstance(batch, Exception):
+            # Put it back for the other learner threads waiting on the queue
+            self.batches.put_nowait(batch)
+            raise batch
+        return batch
+
+
+def create_batch_source(b_queue, position, flags, lock, batch_size):
+    """
+    Returns a function that gives the next batch of `position`, through
+    a `BatchPrefetcher` unless --prefetch_batches is 0, and drawn from a
+    replay store when --replay_capacity is set.
+    """
+    if flags.prefetch_batches > 0:
+        prefetcher = BatchPrefetcher(b_queue, position, flags, lock, batch_size, depth=flags.prefetch_batches,
+                                     pin_memory=flags.pin_memory and flags.training_device != 'cpu')
+        next_batch = prefetcher.get
+    else:
+        next_batch = lambda: get_batch(b_queue, position, flags, lock, batch_size=batch_size())
+    if flags.replay_capacity > 0:
+        return ReplaySource(next_batch, ReplayBuffer(flags.replay_capacity, flags.replay_policy), flags.replay_ratio)
+    return next_batch
+
+
+def create_optimizer(flags, parameters):
+    return torch.optim.RAdam(
+        parameters,
+        lr=flags.learning_rate,
+        eps=flags.epsilon)
+
+
 def create_optimizers(flags, learner_model):
     positions = ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']
     optimizers = {}
     for position in positions:
-        optimizer = torch.optim.RAdam(
-            learner_model.parameters(position),
-            lr=flags.learning_rate,
-            eps=flags.epsilon)
-        optimizers[position] = optimizer
+        optimizers[position] = create_optimizer(flags, learner_model.parameters(position))
     return optimizers
 
 
-def act(i, device, batch_queues, model, flags):
+def actor_crash_path(flags, device, i):
+    """
+    File where actor `i` of `device` writes its traceback before dying.
+    """
+    return os.path.expandvars(os.path.expanduser(
+        '%s/%s/actor_crash_%s_%d.txt' % (flags.savedir, flags.xpid, device, i)))
+
+
+def act(i, device, batch_queues, model, flags, recorder=None, seed=None):
     positions = ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']
+    timer = timeit.default_timer
     try:
-        T = flags.unroll_length
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+            torch.manual_seed(seed)
+        T = get_unroll_lengths(flags)
+        if recorder is None:
+            recorder = ActorStats(1).recorder(0)
+        if isinstance(model, Model) and flags.actor_inference != 'eager':
+            model = InferenceModel(model, flags.actor_inference, flags.inference_refresh)
+        tracing.configure(flags, 'actor-%s-%d' % (device, i))
         log.info('Device %s Actor %i started.', str(device), i)
 
         env = create_env(flags)
@@ -78,17 +264,26 @@ def act(i, device, batch_queues, model, flags):
         obs_z_buf = {p: [] for p in positions}
         size = {p: 0 for p in positions}
         obs_x_batch_buf = {p: [] for p in positions}
+        version_buf = {p: [] for p in positions}
 
         position, obs, env_output = env.initial(model, device, flags=flags)
 
         while True:
             while True:
-
+                tracing.begin_step()
+                start = timer()
+                forward_time = 0.
+                recorder.add('decisions', 1)
+                recorder.add_legal_actions(len(obs['legal_actions']))
                 if len(obs['legal_actions']) > 1:
-                    with torch.no_grad():
+                    with torch.no_grad(), autocast(flags, device):
                         agent_output = model.forward(position, obs['z_batch'], obs['x_batch'], flags=flags)
                     _action_idx = int(agent_output['action'].cpu().detach().numpy())
                     action = obs['legal_actions'][_action_idx]
+                    forward_time = timer() - start
+                    recorder.add('forward', forward_time)
+                    tracing.record('forward', start, start + forward_time, position=position,
+                                   legal_actions=len(obs['legal_actions']))
 
                     if position in ['first', 'second', 'third']:
                         obs_z_buf[position].append(
@@ -107,10 +302,22 @@ def act(i, device, batch_queues, model, flags):
 
                 x_batch = env_output['obs_x_no_action'].float()
                 obs_x_batch_buf[position].append(x_batch)
+                version_buf[position].append(model.get_version(position))
                 size[position] += 1
+
+                step_start = timer()
+                recorder.add('assemble', step_start - start - forward_time)
+                encode_start = env.encode_time
                 position, obs, env_output = env.step(action, model, device, flags=flags)
+                encode = env.encode_time - encode_start
+                recorder.add('encode', encode)
+                step_end = timer()
+                recorder.add('env_step', step_end - step_start - encode)
+                tracing.record('env_step', step_start, step_end)
 
                 if env_output['done'] or env_output['draw']:
+                    recorder.add('games', 1)
+                    start = timer()
                     for p in positions:
                         diff = size[p] - len(target_adp_buf[p])
                         if diff > 0:
@@ -129,31 +336,42 @@ def act(i, device, batch_queues, model, flags):
                             target_adp_buf[p].extend([episode_return for _ in range(diff)])
                             target_wp_buf[p].extend([wp_return for _ in range(diff)])
                             target_wp_bid_buf[p].extend([torch.tensor(wp_bid) for _ in range(diff)])
+                    recorder.add('assemble', timer() - start)
                     break
             for p in positions:
-                if size[p] > T:
-                    batch_queues[p].put({
-                        "done": torch.stack([torch.tensor(ndarr, device="cpu") for ndarr in done_buf[p][:T]]),
+                if size[p] > T[p]:
+                    start = timer()
+                    rollout = {
+                        "done": torch.stack([torch.tensor(ndarr, device="cpu") for ndarr in done_buf[p][:T[p]]]),
                         "episode_return": torch.stack(
-                            [torch.tensor(ndarr, device="cpu") for ndarr in episode_return_buf[p][:T]]),
+                            [torch.tensor(ndarr, device="cpu") for ndarr in episode_return_buf[p][:T[p]]]),
                         "target_adp": torch.stack(
-                            [torch.tensor(ndarr, device="cpu") for ndarr in target_adp_buf[p][:T]]),
+                            [torch.tensor(ndarr, device="cpu") for ndarr in target_adp_buf[p][:T[p]]]),
                         "target_wp": torch.stack(
-                            [torch.tensor(ndarr, device="cpu") for ndarr in target_wp_buf[p][:T]]),
+                            [torch.tensor(ndarr, device="cpu") for ndarr in target_wp_buf[p][:T[p]]]),
                         "target_wp_bid": torch.stack(
-                            [ndarr.clone().detach() for ndarr in target_wp_bid_buf[p][:T]]),
-                        "obs_z": torch.stack([ndarr.clone().detach() for ndarr in obs_z_buf[p][:T]]),
+                            [ndarr.clone().detach() for ndarr in target_wp_bid_buf[p][:T[p]]]),
+                        "obs_z": torch.stack([ndarr.clone().detach() for ndarr in obs_z_buf[p][:T[p]]]),
                         "obs_x_batch": torch.stack(
-                            [ndarr.clone().detach() for ndarr in obs_x_batch_buf[p][:T]]),
-                    })
-                    done_buf[p] = done_buf[p][T:]
-                    episode_return_buf[p] = episode_return_buf[p][T:]
-                    target_adp_buf[p] = target_adp_buf[p][T:]
-                    target_wp_buf[p] = target_wp_buf[p][T:]
-                    target_wp_bid_buf[p] = target_wp_bid_buf[p][T:]
-                    obs_x_batch_buf[p] = obs_x_batch_buf[p][T:]
-                    obs_z_buf[p] = obs_z_buf[p][T:]
-                    size[p] -= T
+                            [ndarr.clone().detach() for ndarr in obs_x_batch_buf[p][:T[p]]]),
+                        "version": torch.tensor(version_buf[p][:T[p]], dtype=torch.int64),
+                    }
+                    put_start = timer()
+                    recorder.add('assemble', put_start - start)
+                    batch_queues[p].put(rollout)
+                    put_end = timer()
+                    recorder.add('queue_put', put_end - put_start)
+                    tracing.record('queue_put', put_start, put_end, position=p)
+                    done_buf[p] = done_buf[p][T[p]:]
+                    episode_return_buf[p] = episode_return_buf[p][T[p]:]
+                    target_adp_buf[p] = target_adp_buf[p][T[p]:]
+                    target_wp_buf[p] = target_wp_buf[p][T[p]:]
+                    target_wp_bid_buf[p] = target_wp_bid_buf[p][T[p]:]
+                    obs_x_batch_buf[p] = obs_x_batch_buf[p][T[p]:]
+                    obs_z_buf[p] = obs_z_buf[p][T[p]:]
+                    version_buf[p] = version_buf[p][T[p]:]
+                    size[p] -= T[p]
+            recorder.flush()
 
     except KeyboardInterrupt:
         pass
@@ -161,6 +379,11 @@ def act(i, device, batch_queues, model, flags):
         log.error('Exception in worker process %i', i)
         traceback.print_exc()
         print()
+        try:
+            with open(actor_crash_path(flags, device, i), 'w') as f:
+                f.write(traceback.format_exc())
+        except OSError:
+            pass
         raise e
 
 
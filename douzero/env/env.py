@@ -1,6 +1,8 @@
 from collections import Counter
+import timeit
 import numpy as np
 
+from douzero.dmc import tracing
 from douzero.env.game import GameEnv
 
 
@@ -26,7 +28,7 @@ cards4sample.extend([17])
 class Env:
 
     def __init__(self, flags):
-        self.objective = flags.bjective
+        self.objective = flags.objective
 
         # Initialize players
         # We use three dummy player for the target position
@@ -39,6 +41,8 @@ class Env:
         self.total_round = 0
         self.infoset = None
         self.wild_mode = flags.wild_mode
+        # Seconds spent building observations, read by the actors
+        self.encode_time = 0.
 
     def reset(self, model, device, flags=None):
         self._env.reset()
@@ -63,7 +67,12 @@ class Env:
 
         bid_over = self._bid_over
         self.infoset = self._bid_infoset
-        return get_obs(self.infoset, bid_over)
+        start = timeit.default_timer()
+        obs = get_obs(self.infoset, bid_over)
+        end = timeit.default_timer()
+        self.encode_time += end - start
+        tracing.record('encode', start, end)
+        return obs
 
     def step(self, action):
         if not self._draw:
@@ -98,7 +107,11 @@ class Env:
         elif self._draw:
             obs = None
         else:
+            start = timeit.default_timer()
             obs = get_obs(self.infoset, self._bid_over)
+            end = timeit.default_timer()
+            self.encode_time += end - start
+            tracing.record('encode', start, end)
         return obs, reward, done, self._draw, {}
 
     def _get_reward(self, pos):
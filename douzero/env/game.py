@@ -438,9 +438,8 @@ class GameEnv(object):
             self.info_sets[self.acting_player_position].player_hand_cards.sort()
 
     def get_legal_card_play_actions(self):
-        md.set_wild_rank(self.wild_rank)
-        ms.set_wild_rank(self.wild_rank)
-        
+        # 癞子牌点数按对局显式传入，不修改 move_detector/move_selector 的全局状态，
+        # 以便同一进程中的多个对局（actor 线程）可以并行
         if self.bid_over:
             mg = MovesGener(
                 self.info_sets[self.acting_player_position].player_hand_cards,
@@ -455,7 +454,7 @@ class GameEnv(object):
                 else:
                     rival_move = action_sequence[-1][1]
 
-            rival_type = md.get_move_type(rival_move)
+            rival_type = md.get_move_type(rival_move, self.wild_rank)
             rival_move_type = rival_type['type']
             rival_move_len = rival_type.get('len', 1)
             moves = list()
@@ -465,58 +464,58 @@ class GameEnv(object):
 
             elif rival_move_type == md.TYPE_1_SINGLE:
                 all_moves = mg.gen_type_1_single()
-                moves = ms.filter_type_1_single(all_moves, rival_move)
+                moves = ms.filter_type_1_single(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_2_PAIR:
                 all_moves = mg.gen_type_2_pair()
-                moves = ms.filter_type_2_pair(all_moves, rival_move)
+                moves = ms.filter_type_2_pair(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_3_TRIPLE:
                 all_moves = mg.gen_type_3_triple()
-                moves = ms.filter_type_3_triple(all_moves, rival_move)
+                moves = ms.filter_type_3_triple(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_4_BOMB:
                 all_moves = mg.gen_type_4_bomb() + mg.gen_type_5_king_bomb()
-                moves = ms.filter_type_4_bomb(all_moves, rival_move)
+                moves = ms.filter_type_4_bomb(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_5_KING_BOMB:
                 moves = []
 
             elif rival_move_type == md.TYPE_6_3_1:
                 all_moves = mg.gen_type_6_3_1()
-                moves = ms.filter_type_6_3_1(all_moves, rival_move)
+                moves = ms.filter_type_6_3_1(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_7_3_2:
                 all_moves = mg.gen_type_7_3_2()
-                moves = ms.filter_type_7_3_2(all_moves, rival_move)
+                moves = ms.filter_type_7_3_2(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_8_SERIAL_SINGLE:
                 all_moves = mg.gen_type_8_serial_single(repeat_num=rival_move_len)
-                moves = ms.filter_type_8_serial_single(all_moves, rival_move)
+                moves = ms.filter_type_8_serial_single(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_9_SERIAL_PAIR:
                 all_moves = mg.gen_type_9_serial_pair(repeat_num=rival_move_len)
-                moves = ms.filter_type_9_serial_pair(all_moves, rival_move)
+                moves = ms.filter_type_9_serial_pair(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_10_SERIAL_TRIPLE:
                 all_moves = mg.gen_type_10_serial_triple(repeat_num=rival_move_len)
-                moves = ms.filter_type_10_serial_triple(all_moves, rival_move)
+                moves = ms.filter_type_10_serial_triple(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_11_SERIAL_3_1:
                 all_moves = mg.gen_type_11_serial_3_1(repeat_num=rival_move_len)
-                moves = ms.filter_type_11_serial_3_1(all_moves, rival_move)
+                moves = ms.filter_type_11_serial_3_1(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_12_SERIAL_3_2:
                 all_moves = mg.gen_type_12_serial_3_2(repeat_num=rival_move_len)
-                moves = ms.filter_type_12_serial_3_2(all_moves, rival_move)
+                moves = ms.filter_type_12_serial_3_2(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_13_4_2:
                 all_moves = mg.gen_type_13_4_2()
-                moves = ms.filter_type_13_4_2(all_moves, rival_move)
+                moves = ms.filter_type_13_4_2(all_moves, rival_move, self.wild_rank)
 
             elif rival_move_type == md.TYPE_14_4_22:
                 all_moves = mg.gen_type_14_4_22()
-                moves = ms.filter_type_14_4_22(all_moves, rival_move)
+                moves = ms.filter_type_14_4_22(all_moves, rival_move, self.wild_rank)
 
             if rival_move_type not in [md.TYPE_0_PASS,
                                        md.TYPE_4_BOMB, md.TYPE_5_KING_BOMB]:
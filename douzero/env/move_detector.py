@@ -4,22 +4,29 @@ import collections
 # 全局癞子牌数值，默认为 None；使用 set_wild_rank(wild) 设置
 WILD_RANK = None
 
+# 未显式传入 wild_rank 时使用全局 WILD_RANK。多个对局并行（例如同一进程中的
+# 多个 actor 线程）时应显式传入各自对局的 wild_rank。
+USE_GLOBAL = object()
+
 def set_wild_rank(wild):
     global WILD_RANK
     WILD_RANK = wild
 
-def effective_rank(move):
+def resolve_wild_rank(wild_rank):
+    return WILD_RANK if wild_rank is USE_GLOBAL else wild_rank
+
+def effective_rank(move, wild_rank=USE_GLOBAL):
     """
     计算动作的有效牌值：
     - 如果动作中存在非癞子牌，则返回其中最小（或首个）的自然牌值；
-    - 否则返回 WILD_RANK 本身。
+    - 否则返回 wild_rank 本身。
     """
-    global WILD_RANK
-    natural = [card for card in move if card != WILD_RANK]
+    wild_rank = resolve_wild_rank(wild_rank)
+    natural = [card for card in move if card != wild_rank]
     if natural:
         return min(natural)
     else:
-        return WILD_RANK
+        return wild_rank
 
 def is_continuous_seq(move):
     # 假设 move 已排序且不含癞子牌
@@ -28,11 +35,12 @@ def is_continuous_seq(move):
             return False
     return True
 
-def get_move_type(move):
+def get_move_type(move, wild_rank=USE_GLOBAL):
     """
     根据动作 move 判断出牌类型，支持癞子牌使用。
-    若动作中含有癞子牌（WILD_RANK），则用 effective_rank() 得到比较值。
+    若动作中含有癞子牌（wild_rank），则用 effective_rank() 得到比较值。
     """
+    wild_rank = resolve_wild_rank(wild_rank)
     move_size = len(move)
     move_dict = collections.Counter(move)
     
@@ -47,8 +55,8 @@ def get_move_type(move):
         # 对子：自然牌相同，或一自然一癞子补全
         if move[0] == move[1]:
             return {'type': TYPE_2_PAIR, 'rank': move[0]}
-        elif (WILD_RANK in move) and ((move[0] != WILD_RANK) or (move[1] != WILD_RANK)):
-            return {'type': TYPE_2_PAIR, 'rank': effective_rank(move)}
+        elif (wild_rank in move) and ((move[0] != wild_rank) or (move[1] != wild_rank)):
+            return {'type': TYPE_2_PAIR, 'rank': effective_rank(move, wild_rank)}
         elif move == [20, 30]:
             return {'type': TYPE_5_KING_BOMB}
         else:
@@ -57,22 +65,22 @@ def get_move_type(move):
     if move_size == 3:
         # 三条：全部相同，或利用癞子补齐
         if len(move_dict) == 1:
-            return {'type': TYPE_3_TRIPLE, 'rank': effective_rank(move)}
+            return {'type': TYPE_3_TRIPLE, 'rank': effective_rank(move, wild_rank)}
         else:
             for card, count in move_dict.items():
-                if card != WILD_RANK and count + move_dict.get(WILD_RANK, 0) >= 3:
+                if card != wild_rank and count + move_dict.get(wild_rank, 0) >= 3:
                     return {'type': TYPE_3_TRIPLE, 'rank': card}
             return {'type': TYPE_15_WRONG}
     
     if move_size == 4:
         if len(move_dict) == 1:
-            return {'type': TYPE_4_BOMB, 'rank': effective_rank(move)}
+            return {'type': TYPE_4_BOMB, 'rank': effective_rank(move, wild_rank)}
         elif len(move_dict) == 2:
             # 可能为三带一：排序后检查前3或后3是否相同（含癞子情况）
             sorted_move = sorted(move)
-            if sorted_move[0] != WILD_RANK and sorted_move[0] == sorted_move[1] == sorted_move[2]:
+            if sorted_move[0] != wild_rank and sorted_move[0] == sorted_move[1] == sorted_move[2]:
                 return {'type': TYPE_6_3_1, 'rank': sorted_move[0]}
-            elif sorted_move[-1] != WILD_RANK and sorted_move[-1] == sorted_move[-2] == sorted_move[-3]:
+            elif sorted_move[-1] != wild_rank and sorted_move[-1] == sorted_move[-2] == sorted_move[-3]:
                 return {'type': TYPE_6_3_1, 'rank': sorted_move[-1]}
             else:
                 return {'type': TYPE_15_WRONG}
@@ -80,8 +88,8 @@ def get_move_type(move):
             return {'type': TYPE_15_WRONG}
     
     # 判断单顺（TYPE_8_SERIAL_SINGLE），支持癞子牌补全
-    natural = sorted([card for card in move if card != WILD_RANK])
-    wild_count = move_dict.get(WILD_RANK, 0)
+    natural = sorted([card for card in move if card != wild_rank])
+    wild_count = move_dict.get(wild_rank, 0)
     if natural:
         candidate = list(range(natural[0], natural[0] + move_size))
         missing = sum(1 for c in candidate if c not in natural)
@@ -91,7 +99,7 @@ def get_move_type(move):
     if move_size == 5:
         if len(move_dict) == 2:
             for card, count in move_dict.items():
-                if card != WILD_RANK and count + move_dict.get(WILD_RANK, 0) == 3:
+                if card != wild_rank and count + move_dict.get(wild_rank, 0) == 3:
                     return {'type': TYPE_7_3_2, 'rank': card}
         return {'type': TYPE_15_WRONG}
     
@@ -103,15 +111,15 @@ def get_move_type(move):
     if move_size == 6:
         if (len(move_dict) in [2,3]) and count_dict.get(4) == 1 and \
            (count_dict.get(2) == 1 or count_dict.get(1) == 2):
-            return {'type': TYPE_13_4_2, 'rank': effective_rank(move)}
+            return {'type': TYPE_13_4_2, 'rank': effective_rank(move, wild_rank)}
     
     if move_size == 8 and (((len(move_dict) in [2,3]) and (count_dict.get(4) == 1 and count_dict.get(2) == 2)) \
        or count_dict.get(4) == 2):
-        natural_bombs = [c for c, n in move_dict.items() if c != WILD_RANK and n == 4]
+        natural_bombs = [c for c, n in move_dict.items() if c != wild_rank and n == 4]
         if natural_bombs:
             return {'type': TYPE_14_4_22, 'rank': max(natural_bombs)}
     
-    mdkeys = sorted([k for k in move_dict.keys() if k != WILD_RANK])
+    mdkeys = sorted([k for k in move_dict.keys() if k != wild_rank])
     if mdkeys and (len(move_dict) == count_dict.get(2)) and is_continuous_seq(mdkeys):
         return {'type': TYPE_9_SERIAL_PAIR, 'rank': mdkeys[0], 'len': len(mdkeys)}
     
@@ -123,7 +131,7 @@ def get_move_type(move):
         single = []
         pair = []
         for k, v in move_dict.items():
-            if k == WILD_RANK:
+            if k == wild_rank:
                 continue
             if v >= 3:
                 serial_3.append(k)
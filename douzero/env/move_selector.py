@@ -3,110 +3,118 @@ import collections
 # 全局癞子牌数值
 WILD_RANK = None
 
+# 未显式传入 wild_rank 时使用全局 WILD_RANK
+USE_GLOBAL = object()
+
 def set_wild_rank(wild):
     global WILD_RANK
     WILD_RANK = wild
 
-def effective_rank(move):
+def resolve_wild_rank(wild_rank):
+    return WILD_RANK if wild_rank is USE_GLOBAL else wild_rank
+
+def effective_rank(move, wild_rank=USE_GLOBAL):
     """
-    计算动作的有效牌值：如果存在自然牌则返回其中最小的自然牌值，否则返回 WILD_RANK。
+    计算动作的有效牌值：如果存在自然牌则返回其中最小的自然牌值，否则返回 wild_rank。
     """
-    natural = [card for card in move if card != WILD_RANK]
+    wild_rank = resolve_wild_rank(wild_rank)
+    natural = [card for card in move if card != wild_rank]
     if natural:
         return min(natural)
     else:
-        return WILD_RANK
+        return wild_rank
 
-def common_handle(moves, rival_move):
+def common_handle(moves, rival_move, wild_rank=USE_GLOBAL):
     new_moves = []
-    rival_eff = effective_rank(rival_move)
+    rival_eff = effective_rank(rival_move, wild_rank)
     for move in moves:
-        if effective_rank(move) > rival_eff:
+        if effective_rank(move, wild_rank) > rival_eff:
             new_moves.append(move)
     return new_moves
 
-def filter_type_1_single(moves, rival_move):
-    return common_handle(moves, rival_move)
+def filter_type_1_single(moves, rival_move, wild_rank=USE_GLOBAL):
+    return common_handle(moves, rival_move, wild_rank)
 
-def filter_type_2_pair(moves, rival_move):
-    return common_handle(moves, rival_move)
+def filter_type_2_pair(moves, rival_move, wild_rank=USE_GLOBAL):
+    return common_handle(moves, rival_move, wild_rank)
 
-def filter_type_3_triple(moves, rival_move):
-    return common_handle(moves, rival_move)
+def filter_type_3_triple(moves, rival_move, wild_rank=USE_GLOBAL):
+    return common_handle(moves, rival_move, wild_rank)
 
-def filter_type_4_bomb(moves, rival_move):
-    return common_handle(moves, rival_move)
+def filter_type_4_bomb(moves, rival_move, wild_rank=USE_GLOBAL):
+    return common_handle(moves, rival_move, wild_rank)
 
 # King bomb 无需筛选
 
-def filter_type_6_3_1(moves, rival_move):
-    rival_eff = effective_rank(rival_move)
+def filter_type_6_3_1(moves, rival_move, wild_rank=USE_GLOBAL):
+    rival_eff = effective_rank(rival_move, wild_rank)
     new_moves = []
     for move in moves:
-        if effective_rank(move) > rival_eff:
+        if effective_rank(move, wild_rank) > rival_eff:
             new_moves.append(move)
     return new_moves
 
-def filter_type_7_3_2(moves, rival_move):
-    rival_eff = effective_rank(rival_move)
+def filter_type_7_3_2(moves, rival_move, wild_rank=USE_GLOBAL):
+    rival_eff = effective_rank(rival_move, wild_rank)
     new_moves = []
     for move in moves:
-        if effective_rank(move) > rival_eff:
+        if effective_rank(move, wild_rank) > rival_eff:
             new_moves.append(move)
     return new_moves
 
-def filter_type_8_serial_single(moves, rival_move):
-    return common_handle(moves, rival_move)
+def filter_type_8_serial_single(moves, rival_move, wild_rank=USE_GLOBAL):
+    return common_handle(moves, rival_move, wild_rank)
 
-def filter_type_9_serial_pair(moves, rival_move):
-    return common_handle(moves, rival_move)
+def filter_type_9_serial_pair(moves, rival_move, wild_rank=USE_GLOBAL):
+    return common_handle(moves, rival_move, wild_rank)
 
-def filter_type_10_serial_triple(moves, rival_move):
-    return common_handle(moves, rival_move)
+def filter_type_10_serial_triple(moves, rival_move, wild_rank=USE_GLOBAL):
+    return common_handle(moves, rival_move, wild_rank)
 
-def filter_type_11_serial_3_1(moves, rival_move):
+def filter_type_11_serial_3_1(moves, rival_move, wild_rank=USE_GLOBAL):
     rival_counter = collections.Counter(rival_move)
     # 取 triple 部分的最高自然牌
-    rival_eff = max([k for k, v in rival_counter.items() if v >= 3] or [effective_rank(rival_move)])
+    rival_eff = max([k for k, v in rival_counter.items() if v >= 3] or [effective_rank(rival_move, wild_rank)])
     new_moves = []
     for move in moves:
         move_counter = collections.Counter(move)
-        my_eff = max([k for k, v in move_counter.items() if v >= 3] or [effective_rank(move)])
+        my_eff = max([k for k, v in move_counter.items() if v >= 3] or [effective_rank(move, wild_rank)])
         if my_eff > rival_eff:
             new_moves.append(move)
     return new_moves
 
-def filter_type_12_serial_3_2(moves, rival_move):
+def filter_type_12_serial_3_2(moves, rival_move, wild_rank=USE_GLOBAL):
     rival_counter = collections.Counter(rival_move)
-    rival_eff = max([k for k, v in rival_counter.items() if v >= 3] or [effective_rank(rival_move)])
+    rival_eff = max([k for k, v in rival_counter.items() if v >= 3] or [effective_rank(rival_move, wild_rank)])
     new_moves = []
     for move in moves:
         move_counter = collections.Counter(move)
-        my_eff = max([k for k, v in move_counter.items() if v >= 3] or [effective_rank(move)])
+        my_eff = max([k for k, v in move_counter.items() if v >= 3] or [effective_rank(move, wild_rank)])
         if my_eff > rival_eff:
             new_moves.append(move)
     return new_moves
 
-def filter_type_13_4_2(moves, rival_move):
-    rival_eff = effective_rank(rival_move)
+def filter_type_13_4_2(moves, rival_move, wild_rank=USE_GLOBAL):
+    rival_eff = effective_rank(rival_move, wild_rank)
     new_moves = []
     for move in moves:
-        if effective_rank(move) > rival_eff:
+        if effective_rank(move, wild_rank) > rival_eff:
             new_moves.append(move)
     return new_moves
 
-def filter_type_14_4_22(moves, rival_move):
+def filter_type_14_4_22(moves, rival_move, wild_rank=USE_GLOBAL):
+    wild_rank = resolve_wild_rank(wild_rank)
     rival_counter = collections.Counter(rival_move)
     rival_eff = 0
     for k, v in rival_counter.items():
-        if v == 4 and k != WILD_RANK:
+        if v == 4 and k != wild_rank:
             rival_eff = max(rival_eff, k)
     new_moves = []
     for move in moves:
         move_counter = collections.Counter(move)
         my_eff = 0
         for k, v in move_counter.items():
-            if v == 4 and k != WILD_RANK:
+            if v == 4 and k != wild_rank:
                 my_eff = max(my_eff, k)
         if my_eff > rival_eff:
             new_moves.append(move)
@@ -9,37 +9,64 @@ from collections import Counter
 
 
 def _load_model(position, model_path, model_type):
-    from douzero.dmc.models import model_dict, model_dict_douzero
+    """
+    The network of `model_path` and its model type. Exported files are
+    typed by their network class, the other files by `model_type`.
+    """
+    from douzero.dmc.models import model_dict_douzero, create_model
+    from douzero.dmc.checkpoint import unpack_position
+    from douzero.dmc.archive import load_checkpoint
+    from douzero.dmc.export import is_exported, load_exported
+    # Also loads "<archive>#<name>" from a checkpoint archive
+    if torch.cuda.is_available():
+        pretrained = load_checkpoint(model_path, map_location='cuda:0')
+    else:
+        pretrained = load_checkpoint(model_path, map_location='cpu')
+    if is_exported(pretrained):
+        # Inference-only checkpoint written by export_model.py
+        model = load_exported(pretrained)
+        if torch.cuda.is_available():
+            model.cuda()
+        return model, "best" if pretrained['arch'].startswith('douzero.dmc.models_res.') else "new"
     if model_type == "test":
         model = model_dict_douzero[position]()
     elif model_type == "best":
         from douzero.dmc.models_res import model_dict_resnet
         model = model_dict_resnet[position]()
     else:
-        model = model_dict[position]()
+        # The architecture is recorded in the checkpoint, or inferred
+        # from the weights of older checkpoints
+        pretrained, arch = unpack_position(pretrained)
+        model = create_model(arch)
+        # Take over the loaded tensors instead of copying them, so that
+        # memory-mapped weights stay shared between the workers
+        model.load_state_dict(pretrained, assign=True)
+        if torch.cuda.is_available():
+            model.cuda()
+        model.eval()
+        return model, model_type
     model_state_dict = model.state_dict()
-    if torch.cuda.is_available():
-        pretrained = torch.load(model_path, map_location='cuda:0')
-    else:
-        pretrained = torch.load(model_path, map_location='cpu')
     pretrained = {k: v for k, v in pretrained.items() if k in model_state_dict}
     model_state_dict.update(pretrained)
     model.load_state_dict(model_state_dict)
     if torch.cuda.is_available():
         model.cuda()
     model.eval()
-    return model
+    return model, model_type
 
 class DeepAgent:
 
-    def __init__(self, position, model_path):
+    def __init__(self, position, model_path, inference='eager'):
         if "test" in model_path:
             self.model_type = "test"
         elif "best" in model_path:
             self.model_type = "best"
         else:
             self.model_type = "new"
-        self.model = _load_model(position, model_path, self.model_type)
+        self.model, self.model_type = _load_model(position, model_path, self.model_type)
+        if self.model_type == "new" and inference != 'eager':
+            from douzero.dmc.inference import CompiledValues
+            self.model = CompiledValues(self.model, inference, name=position)
         self.EnvCard2RealCard = {3: '3', 4: '4', 5: '5', 6: '6', 7: '7',
                             8: '8', 9: '9', 10: 'T', 11: 'J', 12: 'Q',
                             13: 'K', 14: 'A', 17: '2', 20: 'X', 30: 'D'}
@@ -64,6 +91,20 @@ class DeepAgent:
         else:
             obs = get_obs(infoset, bid_over=infoset.bid_over, new_model=True)
 
+        if self.model_type == "test":
+            # The history window is the same for all legal actions, so
+            # the LSTM runs once and only the dense head per action
+            z = torch.from_numpy(obs['z']).float().unsqueeze(0)
+            x_batch = torch.from_numpy(obs['x_batch']).float()
+            if torch.cuda.is_available():
+                z, x_batch = z.cuda(), x_batch.cuda()
+            with torch.no_grad():
+                history = self.model.encode_history(z)
+                y_pred = self.model.head(history.expand(x_batch.shape[0], -1), x_batch)
+            y_pred = y_pred.cpu().numpy()
+            best_action_index = np.argmax(y_pred, axis=0)[0]
+            return infoset.legal_actions[best_action_index]
+
         z_batch = torch.from_numpy(obs['z_batch']).float()
         x_batch = torch.from_numpy(obs['x_batch']).float()
         if torch.cuda.is_available():
@@ -27,7 +27,7 @@ def print(*args, **kwargs):
         output_list.append(" ".join(args) + end)
 
 
-def load_card_play_models(card_play_model_path_dict):
+def load_card_play_models(card_play_model_path_dict, inference='eager'):
     players = {}
 
     for position in ['first', 'second', 'third', 'landlord', 'landlord_down', 'landlord_up']:
@@ -43,20 +43,20 @@ def load_card_play_models(card_play_model_path_dict):
         else:
             from .deep_agent import DeepAgent
             if not isinstance(card_play_model_path_dict[position], list):
-                players[position] = DeepAgent(position, card_play_model_path_dict[position])
+                players[position] = DeepAgent(position, card_play_model_path_dict[position], inference)
             else:
                 paths = card_play_model_path_dict[position]
                 if "landlord" in paths[0]:
                     players[position] = {
-                        "landlord": DeepAgent("landlord", paths[0]),
-                        "landlord_down": DeepAgent("landlord_down", paths[1]),
-                        "landlord_up": DeepAgent("landlord_up", paths[2]),
+                        "landlord": DeepAgent("landlord", paths[0], inference),
+                        "landlord_down": DeepAgent("landlord_down", paths[1], inference),
+                        "landlord_up": DeepAgent("landlord_up", paths[2], inference),
                     }
                 elif "first" in paths[0]:
                     players[position] = {
-                        "first": DeepAgent("first", paths[0]),
-                        "second": DeepAgent("second", paths[1]),
-                        "third": DeepAgent("third", paths[2])
+                        "first": DeepAgent("first", paths[0], inference),
+                        "second": DeepAgent("second", paths[1], inference),
+                        "third": DeepAgent("third", paths[2], inference)
                     }
     return players
 
@@ -88,11 +88,11 @@ def get_modelname_by_path(model_path):
         return model_path.split(sep)[-1].split(".")[0]
 
 
-def mp_simulate(card_play_data_list, card_play_model_path_dict, q):
+def mp_simulate(card_play_data_list, card_play_model_path_dict, q, inference='eager'):
     for k in card_play_model_path_dict:
         if "|" in card_play_model_path_dict[k]:
             card_play_model_path_dict[k] = card_play_model_path_dict[k].split("|")
-    players = load_card_play_models(card_play_model_path_dict)
+    players = load_card_play_models(card_play_model_path_dict, inference)
 
     Env = GameEnv(players)
     enable_output = False
@@ -186,7 +186,7 @@ def data_allocation_per_worker(card_play_data_list, num_workers):
     return card_play_data_list_each_worker
 
 
-def evaluate(first, second, third, playcard_1, playcard_2, playcard_3, eval_data, num_workers):
+def evaluate(first, second, third, playcard_1, playcard_2, playcard_3, eval_data, num_workers, inference='eager'):
 
     with open(eval_data, 'rb') as f:
         card_play_data_list = pickle.load(f)
@@ -234,7 +234,7 @@ def evaluate(first, second, third, playcard_1, playcard_2, playcard_3, eval_data
     for card_paly_data in card_play_data_list_each_worker:
         p = ctx.Process(
                 target=mp_simulate,
-                args=(card_paly_data, card_play_model_path_dict, q))
+                args=(card_paly_data, card_play_model_path_dict, q, inference))
         p.start()
         processes.append(p)
 
@@ -283,3 +283,11 @@ def evaluate(first, second, third, playcard_1, playcard_2, playcard_3, eval_data
             os.mkdir("./eval_results")
         with open("./eval_results/" + eval_name + ".txt", 'a') as f:
             f.write("".join(output_list))
+
+    return {
+        'landlord_wp': num_landlord_wins / num_total_wins,
+        'farmer_wp': num_farmer_wins / num_total_wins,
+        'landlord_adp': num_landlord_scores / num_total_wins,
+        'farmer_adp': num_farmer_scores / num_total_wins,
+        'draws': num_draw,
+    }
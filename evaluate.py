@@ -1,6 +1,7 @@
 import os
 import argparse
 from douzero.evaluation.simulation import evaluate
+from douzero.dmc.inference import INFERENCE_MODES
 import random
 import numpy as np
 import torch
@@ -30,6 +31,8 @@ if __name__ == '__main__':
     parser.add_argument('--eval_data', type=str, default='eval_data.pkl')
     parser.add_argument('--num_workers', type=int, default=2)
     parser.add_argument('--gpu_device', type=str, default='')
+    parser.add_argument('--inference', type=str, default='eager',
+                        choices=INFERENCE_MODES)
     args = parser.parse_args()
 
     os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
@@ -55,4 +58,5 @@ if __name__ == '__main__':
              args.player_2_playcard,
              args.player_3_playcard,
              args.eval_data,
-             args.num_workers)
+             args.num_workers,
+             args.inference)
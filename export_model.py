@@ -0,0 +1,68 @@
+"""
+Writes inference-only checkpoints with the batch norms folded into the
+convolutions (see douzero/dmc/export.py). DeepAgent loads them like
+the training checkpoints, and evaluate.py takes them in place of them.
+With --format mapped the weights are written raw (see
+douzero/dmc/mapped.py), so the evaluation workers memory-map and share
+them instead of each reading a copy.
+
+    python export_model.py --input landlord_0.ckpt --output landlord_0_infer.ckpt
+    python export_model.py --input model.tar --output exported/ --format mapped
+"""
+import argparse
+import os
+
+import torch
+
+from douzero.dmc.archive import load_checkpoint
+from douzero.dmc.checkpoint import unpack_position
+from douzero.dmc.export import arch_class, arch_kwargs, arch_name, detect_arch, export_model
+from douzero.dmc.mapped import save_mapped
+from douzero.dmc.models import create_model, position_group
+
+POSITIONS = ['first', 'second', 'third', 'landlord', 'landlord_up', 'landlord_down']
+
+
+def export_state_dict(state_dict, output, format='torch', config=None):
+    """Export the network of `state_dict`, built from `config` if it was recorded."""
+    if config is not None:
+        model = create_model(config)
+        arch = arch_name(model)
+    else:
+        arch = detect_arch(state_dict)
+        model = arch_class(arch)(**arch_kwargs(arch, state_dict))
+    model.load_state_dict(state_dict)
+    exported = export_model(model, config)
+    if format == 'mapped':
+        save_mapped(output, exported.pop('state_dict'), exported)
+    else:
+        torch.save(exported, output)
+    print('%s (%s)' % (output, arch))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('AlphaDou inference export')
+    parser.add_argument('--input', type=str, required=True,
+                        help='Position checkpoint (e.g. landlord_0.ckpt or archive.ckpa#landlord_0) '
+                             'or training checkpoint (model.tar)')
+    parser.add_argument('--output', type=str, required=True,
+                        help='Output file, or directory for the positions of a training checkpoint')
+    parser.add_argument('--format', type=str, default='torch', choices=['torch', 'mapped'],
+                        help='torch.save file, or raw weights that evaluation workers memory-map')
+    args = parser.parse_args()
+
+    checkpoint = load_checkpoint(args.input)
+    if 'model_state_dict' in checkpoint:
+        os.makedirs(args.output, exist_ok=True)
+        # Checkpoints of older runs have no recorded architecture
+        archs = checkpoint.get('arch')
+        for position in POSITIONS:
+            export_state_dict(checkpoint['model_state_dict'][position],
+                              os.path.join(args.output, position + '.ckpt'), args.format,
+                              archs[position_group(position)] if archs else None)
+    elif 'arch' in checkpoint and 'state_dict' in checkpoint:
+        state_dict, config = unpack_position(checkpoint)
+        export_state_dict(state_dict, args.output, args.format, config)
+    else:
+        # Weights only, e.g. the models_res networks of the baselines
+        export_state_dict(checkpoint, args.output, args.format)
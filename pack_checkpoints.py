@@ -0,0 +1,41 @@
+"""
+Packs the position checkpoints of a training run into a checkpoint
+archive (see douzero/dmc/archive.py), or lists an archive. Evaluation
+loads a packed checkpoint with the path "<archive>#<name>".
+
+    python pack_checkpoints.py --dir douzero_checkpoints/douzero --output sweep.ckpa
+    python pack_checkpoints.py --list sweep.ckpa
+    python evaluate.py --player_1_playcard 'sweep.ckpa#landlord_1000' ...
+"""
+import argparse
+import os
+
+from douzero.dmc.archive import CheckpointArchive
+from douzero.dmc.checkpoint import POSITION_FILE
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('AlphaDou checkpoint archive')
+    parser.add_argument('--dir', type=str, default='',
+                        help='Directory of position checkpoints (e.g. savedir/xpid)')
+    parser.add_argument('--output', type=str, default='',
+                        help='Archive to create or append to')
+    parser.add_argument('--remove', action='store_true',
+                        help='Delete the checkpoint files once they are packed')
+    parser.add_argument('--list', type=str, default='',
+                        help='Only print the checkpoints of this archive')
+    args = parser.parse_args()
+
+    if args.list:
+        archive = CheckpointArchive(args.list)
+        for name in sorted(archive.names(), key=lambda n: (n.rsplit('_', 1)[0], int(n.rsplit('_', 1)[1]))):
+            print('%s (%.1f MB)' % (name, archive.index[name][1] / 2 ** 20))
+        raise SystemExit
+
+    archive = CheckpointArchive(args.output)
+    files = {name[:-len('.ckpt')]: os.path.join(args.dir, name)
+             for name in sorted(os.listdir(args.dir)) if POSITION_FILE.match(name)}
+    archive.append(files)
+    if args.remove:
+        for path in files.values():
+            os.remove(path)
+    print('Packed %d checkpoints into %s (%d in total)' % (len(files), args.output, len(archive)))